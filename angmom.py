@@ -95,10 +95,165 @@ def g_mult_electrans(j0, s, frag_ratio, pole):
 
     # neutron emissions subtraction
 
-    jg = j_frag - angmom_emission(s, nubar_jeff[1:])
+    jg = j_frag - angmom_emission(s, ENV.nubar_jeff[1:])
 
     # electric transisions of remnant momentum
     
     g_mult = electric_trans(pole, jg)
 
-    return g_mult
\ No newline at end of file
+    return g_mult
+
+
+def angmom_slope(energies, g_mult):
+    """
+    Slope of the gamma-rays multiplicity difference vs. the initial angular
+    momentum difference (least squares through the first bin). Leading axes
+    of g_mult (e.g. bootstrap replicas) are kept.
+
+    Args:
+        energies (narray): Incident neutron energies [MeV].
+        g_mult (narray): Gamma-rays multiplicities, shape (..., energies).
+
+    Returns:
+        float or narray: Slope d(n_gamma)/d(J0) [1/hbar].
+    """
+    j0, _ = angmom_capture(energies)
+    dj0 = diff_init(j0)
+    g_mult = np.asarray(g_mult, dtype=float)
+    dg_mult = g_mult - g_mult[..., :1]
+    return (dg_mult @ dj0) / (dj0 @ dj0)
+
+
+def mixed_trans(f_e1, l):
+    """
+    Gamma-rays multiplicity of a decay mixing E1 (1 hbar) and E2 (2 hbar) transitions.
+
+    Args:
+        f_e1 (float or narray): Fraction of E1 transitions (0 to 1).
+        l (float or narray): Nucleus angular momentum [hbar unit].
+
+    Returns:
+        float or narray: Gamma-rays multiplicity cascade.
+    """
+    return l / (f_e1 + 2. * (1. - f_e1))
+
+
+def read_g_mult_cov(out_name="g_mult.csv"):
+    """
+    Total covariance of unfolded multiplicities from the sidecar of g_mult_unfolding.
+
+    Args:
+        out_name (str): Name of the output CSV file in outputs/.
+
+    Returns:
+        (narray): Incident neutron energies [MeV].
+        (narray): Statistical plus systematic covariance, shape (energies, energies).
+    """
+    with np.load((OUT_DIR/out_name).with_suffix(".cov.npz")) as cov:
+        return cov["energy"], cov["stat_cov"] + cov["syst_cov"]
+
+
+def angmom_chi2_terms(energies, g_mult, g_mult_cov, nubar=None):
+    """
+    Whitened scalar products of the chi2 of the angular momentum model.
+    The model difference from the first bin, (frag_ratio dJ0 - s dnubar) / (2 - f_e1),
+    is linear in frag_ratio and s, so that chi2 is a quadratic form of a few
+    precomputed scalars at any grid point. The covariance of the differences is
+    D C D' with D the difference matrix to the first bin.
+
+    Args:
+        energies (narray): Incident neutron energies [MeV].
+        g_mult (narray): Unfolded gamma-rays multiplicities.
+        g_mult_cov (narray): Covariance of g_mult, shape (energies, energies).
+        nubar (narray or None): Average neutron multiplicities at energies. Defaults to JEFF
+            nubar interpolated at energies.
+
+    Returns:
+        (dict): Products "yy", "yu", "yv", "uu", "uv", "vv" of the whitened data y,
+            dJ0 (u) and dnubar (v), and the number of points "n".
+    """
+    energies = np.asarray(energies, dtype=float)
+    if nubar is None:
+        nubar = np.interp(energies, ENV.jeff[0], ENV.nubar_jeff)
+    nubar = np.asarray(nubar, dtype=float)
+    if nubar.shape != energies.shape:
+        raise ValueError(f"nubar has shape {nubar.shape}, energies {energies.shape}")
+    j0, _ = angmom_capture(energies)
+
+    # differences to the first bin and their covariance
+
+    n = len(energies)
+    diff = np.eye(n)[1:] - np.eye(n)[:1]
+    cov = diff @ np.asarray(g_mult_cov, dtype=float) @ diff.T
+    chol = np.linalg.cholesky(cov)
+    y, u, v = (np.linalg.solve(chol, diff @ x) for x in (np.asarray(g_mult, dtype=float), j0, nubar))
+
+    return {"yy": y @ y, "yu": y @ u, "yv": y @ v, "uu": u @ u, "uv": u @ v, "vv": v @ v, "n": n - 1}
+
+
+def angmom_scan(energies, g_mult, g_mult_cov, s, frag_ratio, f_e1, nubar=None, chunk_size=1 << 22):
+    """
+    Chi2 of the angular momentum model on the grid s x frag_ratio x f_e1,
+    evaluated by chunks of s so that memory stays bounded.
+
+    Args:
+        energies (narray): Incident neutron energies [MeV].
+        g_mult (narray): Unfolded gamma-rays multiplicities.
+        g_mult_cov (narray): Covariance of g_mult.
+        s (narray): Angular momentum taken away per neutron [hbar unit].
+        frag_ratio (narray): Ratio of angular momentum transmitted to the fragments.
+        f_e1 (narray): Fraction of E1 transitions.
+        nubar (narray or None): See angmom_chi2_terms.
+        chunk_size (int): Maximum number of grid points per chunk. Defaults to 4194304.
+
+    Returns:
+        (narray): Chi2, shape (len(s), len(frag_ratio), len(f_e1)).
+    """
+    t = angmom_chi2_terms(energies, g_mult, g_mult_cov, nubar)
+    s, r, f = (np.atleast_1d(np.asarray(x, dtype=float)) for x in (s, frag_ratio, f_e1))
+    inv_m = 1. / (f + 2. * (1. - f))
+
+    chi2 = np.empty((s.size, r.size, f.size))
+    step = max(1, chunk_size // (r.size * f.size))
+    for i in range(0, s.size, step):
+        si = s[i:i + step, None, None]
+        ri = r[None, :, None]
+        proj = ri * t["yu"] - si * t["yv"]
+        norm = ri**2 * t["uu"] - 2. * ri * si * t["uv"] + si**2 * t["vv"]
+        chi2[i:i + step] = t["yy"] - 2. * inv_m * proj + inv_m**2 * norm
+
+    return chi2
+
+
+def angmom_fit(energies, g_mult, g_mult_cov, s, frag_ratio, f_e1, nubar=None, levels=(1., 4.), chunk_size=1 << 22):
+    """
+    Likelihood surfaces and best fit of the angular momentum model on a grid,
+    with profile-likelihood confidence intervals of frag_ratio.
+
+    Args:
+        energies, g_mult, g_mult_cov, s, frag_ratio, f_e1, nubar, chunk_size: See angmom_scan.
+        levels (tuple of float): Delta chi2 of the intervals. Defaults to (1, 4) (1 and 2 sigma).
+
+    Returns:
+        (dict): "chi2" grid, "likelihood" grid (relative to the best point),
+            best "s", "frag_ratio", "f_e1", "chi2_min", "ndof", profile "frag_ratio_chi2"
+            (minimum over s and f_e1) and "frag_ratio_ci" as (low, high) per level.
+    """
+    chi2 = angmom_scan(energies, g_mult, g_mult_cov, s, frag_ratio, f_e1, nubar, chunk_size)
+    s, r, f = (np.atleast_1d(np.asarray(x, dtype=float)) for x in (s, frag_ratio, f_e1))
+    i, j, k = np.unravel_index(np.argmin(chi2), chi2.shape)
+    chi2_min = chi2[i, j, k]
+
+    # profile of frag_ratio and intervals
+
+    profile = chi2.min(axis=(0, 2))
+    ci = []
+    for level in levels:
+        inside = r[profile <= chi2_min + level]
+        ci.append((inside.min(), inside.max()))
+
+    return {
+        "chi2": chi2, "likelihood": np.exp(-0.5 * (chi2 - chi2_min)),
+        "s": s[i], "frag_ratio": r[j], "f_e1": f[k], "chi2_min": chi2_min,
+        "ndof": len(energies) - 1 - 3, "frag_ratio_chi2": profile, "frag_ratio_ci": ci,
+    }
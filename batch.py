@@ -0,0 +1,158 @@
+""" Batch pipeline over many targets, runs and coincidence windows """
+
+
+# librairies
+
+
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from env import *
+from unfolding import g_mult_unfolding
+from merging import merge_windows
+
+
+# functions
+
+
+def read_manifest(filepath):
+    """
+    Read a JSON manifest of measurement sets, e.g.:
+
+        [{"name": "238U_run1", "target": "238U",
+          "files": ["238U_meas_mg_56us.csv", "238U_meas_mg_5us6.csv"],
+          "merge": "cut", "merg": 3, "n_bins": 30, "nubar": "238U_nubar_JEFF4.csv"}]
+
+    "files" are SCONE files (one per coincidence window), combined with the
+    "merge" method of merging.merge_windows ("cut" at index "merg", "ivw", "best"),
+    "nubar" is an evaluation file of data/evaluations/ (defaults to JEFF 238U).
+
+    Args:
+        filepath (str or Path): Path to the manifest.
+
+    Returns:
+        (list of dict): Measurement sets with defaults filled in.
+    """
+    with open(filepath) as f:
+        sets = json.load(f)
+    for i, s in enumerate(sets):
+        s.setdefault("name", f"set_{i}")
+        s.setdefault("target", "")
+        s.setdefault("merge", MERGE)
+        s.setdefault("merg", 3)
+        s.setdefault("n_bins", 30)
+        s.setdefault("nubar", "238U_nubar_JEFF4.csv")
+    return sets
+
+
+def _init_worker(state):
+    """
+    Prime the lazy environment of a worker with the constants of the parent process.
+    """
+    ENV.prime(**state)
+
+
+def run_set(mset, nubar):
+    """
+    Read, merge and unfold one measurement set.
+
+    Args:
+        mset (dict): Measurement set from read_manifest.
+        nubar (tuple): (nubar, nubar_err) of the target per energy.
+
+    Returns:
+        (pd.DataFrame): Unfolded multiplicities of the set.
+    """
+
+    # reading and merging of coincidence windows
+
+    meas = [scone_meas(filename=fname) for fname in mset["files"]]
+    energies = meas[0][0]
+    if len(meas) == 1:
+        g_mult_raw, stat_err_raw = meas[0][1], meas[0][2]
+    else:
+        g_mult_raw, merged_cov, _, _ = merge_windows(
+            [m[1] for m in meas], [m[2] for m in meas], method=mset["merge"], merg=mset["merg"]
+        )
+        stat_err_raw = np.sqrt(np.diag(merged_cov))
+
+    n = mset["n_bins"]
+    energies, g_mult_raw, stat_err_raw = energies[:n], g_mult_raw[:n], stat_err_raw[:n]
+
+    # unfolding
+
+    g_mult, syst_err, stat_err = g_mult_unfolding(
+        energies, g_mult_raw, stat_err=stat_err_raw, nubar=(nubar[0][:n], nubar[1][:n])
+    )
+
+    return pd.DataFrame({
+        "name": mset["name"], "target": mset["target"], "energy": energies,
+        "g_mult": g_mult, "g_mult_err": syst_err, "stat_err": stat_err
+    })
+
+
+def run_batch(sets, n_workers=None, out_name="batch_g_mult.csv"):
+    """
+    Run read, merge and unfold for many measurement sets over a process pool.
+    Response constants, evaluations and the binary versions of the SCONE files
+    are loaded once in the parent process and shared with the workers.
+
+    Args:
+        sets (list of dict): Measurement sets from read_manifest.
+        n_workers (int or None): Number of processes (1 runs in-process). Defaults to None (all CPUs).
+        out_name (str or None): Name of the consolidated output CSV file. Defaults to "batch_g_mult.csv".
+
+    Returns:
+        (pd.DataFrame): Consolidated table of all sets.
+    """
+
+    # shared data (once)
+
+    _ = ENV.params
+    state = ENV.state("response", "unfolding_params")
+    nubars = {}
+    for s in sets:
+        if s["nubar"] not in nubars:
+            _, _, nu, nu_err = csv_data_reader(EVAL_DIR/s["nubar"])
+            nubars[s["nubar"]] = (nu, nu_err)
+    args = [(s, nubars[s["nubar"]]) for s in sets]
+
+    # binary versions of the SCONE files, built once before the workers read them
+
+    for fname in dict.fromkeys(f for s in sets for f in s["files"]):
+        read_matrix(SCONE_DIR/fname)
+
+    # runs
+
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    if n_workers == 1 or len(sets) == 1:
+        results = [run_set(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(state,)) as pool:
+            results = list(pool.map(run_set, *zip(*args)))
+
+    table = pd.concat(results, ignore_index=True)
+
+    # saving consolidated csv
+
+    if out_name is not None:
+        os.makedirs(OUT_DIR, exist_ok=True)
+        table.to_csv(OUT_DIR/out_name, sep=" ", index=False, float_format="%.3g")
+
+    return table
+
+
+# run
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="GASCONE batch unfolding")
+    parser.add_argument("manifest", help="JSON manifest of measurement sets")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of processes")
+    parser.add_argument("-o", "--output", default="batch_g_mult.csv", help="consolidated output CSV in outputs/")
+    args = parser.parse_args()
+
+    run_batch(read_manifest(args.manifest), n_workers=args.workers, out_name=args.output)
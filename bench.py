@@ -0,0 +1,230 @@
+""" Benchmarks of the pipeline on synthetic large-scale SCONE and Geant4 datasets """
+
+
+# librairies
+
+
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+from scipy.stats import binom, poisson
+import pandas as pd
+from env import *
+from response import g_mult_scone, fission_gcasc_resp, fit_scone_response
+from unfolding import g_mult_unfolding, ng_pileup
+
+
+# synthetic truth: SCONE constants (a = number of assemblies), emitted multiplicity vs. energy
+
+BENCH_A, BENCH_B = 17, 23.
+BENCH_NUBAR = (2.4, 0.14) # nubar(E) = 2.4 + 0.14 E
+BENCH_ERR = 1e-2 # nubar error
+
+# sizes of the sample files (scale 1)
+
+SCONE_SHAPE = (50, 31) # energies, multiplicities
+GEANT4_SHAPE = (50, 50) # emitted, detected
+SCONE_COUNTS = 2000 # fissions per energy bin
+GEANT4_EVENTS = 10000 # events per emitted multiplicity
+
+BASELINES = PROJECT_DIR/"bench_baselines.json"
+
+
+# generators
+
+
+def g_mult_true(energies):
+    """
+    Synthetic emitted gamma-rays multiplicity vs. incident energy.
+    """
+    return 6. + 0.05 * energies
+
+
+def synthetic_scone(filepath, n_energies=50, n_mult=31, counts=SCONE_COUNTS, seed=0):
+    """
+    Synthetic SCONE triplet file: detected multiplicities are Poisson distributed
+    around the response g_mult_scone of the true emitted multiplicity, plus the
+    neutron contamination and minus the pile-up of env.py.
+
+    Args:
+        filepath (str or Path): Path of the file to write.
+        n_energies (int): Number of incident energy bins (0.1 to 30 MeV).
+        n_mult (int): Number of multiplicity bins.
+        counts (int): Number of fissions per energy bin.
+        seed (int): Random generator seed.
+
+    Returns:
+        (narray): Incident neutron energies [MeV].
+        (narray): True emitted multiplicities.
+    """
+    rng = np.random.default_rng(seed)
+    energies = np.linspace(0.1, 30., n_energies)
+    nubar = BENCH_NUBAR[0] + BENCH_NUBAR[1] * energies
+    detected = g_mult_scone(BENCH_A, BENCH_B, g_mult_true(energies)) + C * nubar - ng_pileup(energies)
+    mult = np.arange(n_mult)
+    pmf = poisson.pmf(mult[None, :], detected[:, None])
+    pmf /= pmf.sum(axis=1, keepdims=True)
+    write_triplets(filepath, energies, mult, rng.multinomial(counts, pmf).T)
+    return energies, g_mult_true(energies)
+
+
+def synthetic_geant4(filepath, n_emitted=50, n_detected=50, events=GEANT4_EVENTS, seed=0):
+    """
+    Synthetic Geant4 response grid: each emitted gamma-ray fires one of BENCH_A
+    assemblies, so that detected multiplicities are binomial with the average
+    g_mult_scone(BENCH_A, BENCH_B, emitted).
+
+    Args:
+        filepath (str or Path): Path of the file to write.
+        n_emitted (int): Number of emitted multiplicities.
+        n_detected (int): Number of detected multiplicities (> BENCH_A).
+        events (int): Number of events per emitted multiplicity.
+        seed (int): Random generator seed.
+    """
+    rng = np.random.default_rng(seed)
+    emitted, detected = np.arange(n_emitted), np.arange(n_detected)
+    p = 1. - np.exp(-emitted / BENCH_B)
+    pmf = binom.pmf(detected[None, :], BENCH_A, p[:, None])
+    pmf /= pmf.sum(axis=1, keepdims=True)
+    write_triplets(filepath, emitted, detected, rng.multinomial(events, pmf).T)
+
+
+# measurements
+
+
+def measure(func, *args, **kwargs):
+    """
+    Wall time and peak traced memory of one call.
+
+    Returns:
+        (object): Result of the call.
+        (float): Wall time [s].
+        (float): Peak memory allocated during the call [MB].
+    """
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    wall = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return result, wall, peak
+
+
+def run_scale(scale, workdir, seed=0):
+    """
+    Benchmark every stage on synthetic data scale times larger than the sample files
+    (more energy bins for SCONE, more emitted multiplicities for Geant4).
+
+    Args:
+        scale (int): Size factor.
+        workdir (Path): Directory of the synthetic files.
+        seed (int): Random generator seed.
+
+    Returns:
+        (dict): For each stage, "time" [s], "throughput" [cells/s], "peak_mb", plus accuracy checks.
+    """
+    n_e, n_m = SCONE_SHAPE[0] * scale, SCONE_SHAPE[1]
+    n_x, n_y = GEANT4_SHAPE[0] * scale, GEANT4_SHAPE[1]
+    scone_file, g4_file = workdir/f"bench_scone_x{scale}.csv", workdir/f"bench_geant4_x{scale}.txt"
+    energies, truth = synthetic_scone(scone_file, n_e, n_m, seed=seed)
+    synthetic_geant4(g4_file, n_x, n_y, seed=seed)
+
+    results = {}
+
+    def stage(name, cells, func, *args, **kwargs):
+        out, wall, peak = measure(func, *args, **kwargs)
+        results[name] = {"time": wall, "throughput": cells / wall, "peak_mb": peak}
+        return out
+
+    # reading (text conversion, then binary) and moments
+
+    stage("read_matrix_text", n_e * n_m, read_matrix, scone_file)
+    _, _, counts = stage("read_matrix_binary", n_e * n_m, read_matrix, scone_file)
+    stage("scone_meas", n_e * n_m, scone_meas, scone_file)
+    n, s1, s2 = power_sums(counts, np.arange(n_m), 2)
+    g_mult_raw, stat_err = s1 / n, np.sqrt((s2 / n - (s1 / n)**2) / n)
+
+    # Geant4 response and fit
+
+    x, y = stage("fission_gcasc_resp", n_x * n_y, fission_gcasc_resp, g4_file)
+    popt, _, _ = stage("fit_scone_response", n_x * n_y, fit_scone_response, [g4_file], use_cache=False)
+
+    # unfolding of every energy bin
+
+    nubar = (BENCH_NUBAR[0] + BENCH_NUBAR[1] * energies, np.full(n_e, BENCH_ERR))
+    params = np.array([*popt, C, *PILEUP])
+    g_mult, _, _ = stage("g_mult_unfolding", n_e, g_mult_unfolding, energies, g_mult_raw, stat_err,
+                         params=params, params_cov=np.diag([*0. * popt, DC, *DPILEUP])**2, nubar=nubar)
+
+    # accuracy against the synthetic truth
+
+    results["check"] = {
+        "a": float(popt[0]), "b": float(popt[1]),
+        "pull_max": float(np.nanmax(np.abs(g_mult - truth) / (stat_err * BENCH_B / (BENCH_A - g_mult_raw)))),
+    }
+
+    # binary versions of the synthetic files
+
+    for f in (scone_file, g4_file):
+        for path in matrix_paths(f):
+            path.unlink(missing_ok=True)
+
+    return results
+
+
+def compare(results, baselines, tolerance=1.5):
+    """
+    Ratios of times and memory to the stored baselines.
+
+    Args:
+        results (dict): Benchmarks per scale (run_scale).
+        baselines (dict): Stored benchmarks per scale.
+        tolerance (float): Ratio above which a stage is flagged as a regression. Defaults to 1.5.
+
+    Returns:
+        (pd.DataFrame): Scale, stage, time, peak memory, ratios and regression flag.
+    """
+    rows = []
+    for scale, stages in results.items():
+        for name, r in stages.items():
+            if name == "check":
+                continue
+            base = baselines.get(scale, {}).get(name)
+            time_ratio = r["time"] / base["time"] if base else np.nan
+            mem_ratio = r["peak_mb"] / base["peak_mb"] if base and base["peak_mb"] > 0 else np.nan
+            rows.append({
+                "scale": scale, "stage": name, "time": r["time"], "throughput": r["throughput"],
+                "peak_mb": r["peak_mb"], "time_ratio": time_ratio, "mem_ratio": mem_ratio,
+                "regression": bool(time_ratio > tolerance or mem_ratio > tolerance),
+            })
+    return pd.DataFrame(rows)
+
+
+# run
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="GASCONE benchmarks on synthetic datasets")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000], help="size factors")
+    parser.add_argument("--save", action="store_true", help="store the results as new baselines")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="regression threshold on ratios")
+    parser.add_argument("--seed", type=int, default=0, help="random generator seed")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = {str(s): run_scale(s, Path(workdir), seed=args.seed) for s in args.scales}
+
+    baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+    table = compare(results, baselines, args.tolerance)
+    print(table.to_string(index=False, float_format="%.3g"))
+    for scale, r in results.items():
+        c = r["check"]
+        print(f"x{scale}: a = {c['a']:.3f} ({BENCH_A}), b = {c['b']:.3f} ({BENCH_B}), max pull = {c['pull_max']:.2f}")
+
+    if args.save:
+        baselines.update(results)
+        BASELINES.write_text(json.dumps(baselines, indent=1))
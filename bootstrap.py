@@ -0,0 +1,147 @@
+""" Bootstrap of SCONE raw counts for statistical errors """
+
+# librairies
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from env import *
+from unfolding import gamma_unfolding, neutron_contamination, ng_pileup
+from merging import merge_weights, merge_values
+
+# functions
+
+
+def mult_mean(counts, mult):
+    """
+    Average multiplicity of each energy column, for any number of leading replica axes.
+
+    Args:
+        counts (narray): Counts, shape (..., multiplicities, energies).
+        mult (narray): Multiplicity axis.
+
+    Returns:
+        (narray): Average multiplicities, shape (..., energies).
+    """
+    n, s1 = power_sums(counts, mult, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return s1 / n
+
+
+def resample_counts(counts, n_rep, rng, method="poisson"):
+    """
+    Bootstrap replicas of a count matrix.
+
+    Args:
+        counts (narray): Counts, shape (multiplicities, energies).
+        n_rep (int): Number of replicas.
+        rng (Generator): Random generator.
+        method (str): "poisson" (independent cells) or "multinomial" (fixed column totals).
+
+    Returns:
+        (narray): Replicas, shape (n_rep, multiplicities, energies).
+    """
+    counts = np.asarray(counts)
+    if method == "poisson":
+        return rng.poisson(counts, size=(n_rep,) + counts.shape)
+    if method == "multinomial":
+        totals = counts.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pvals = np.where(totals > 0, counts / totals, 0.).T
+        pvals[totals == 0, 0] = 1.
+        return np.swapaxes(rng.multinomial(totals.astype(np.int64), pvals, size=(n_rep, totals.size)), 1, 2)
+    raise ValueError(f"Unknown bootstrap method: {method}")
+
+
+def _replica_chunk(args):
+    """
+    Merged raw and unfolded multiplicities of a chunk of bootstrap replicas (process pool worker).
+    """
+    counts, mult, weights, n_rep, seed, method, resp, n_contam, pileup = args
+    rng = np.random.default_rng(seed)
+    raw = [mult_mean(resample_counts(c, n_rep, rng, method), mult) for c in counts]
+    g_mult_raw = merge_values(raw, weights)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g_mult = gamma_unfolding(resp, g_mult_raw - n_contam + pileup)
+    return g_mult_raw, g_mult
+
+
+def bootstrap_replicas(filenames=("238U_meas_mg_56us.csv", "238U_meas_mg_5us6.csv"), merg=3, merge=MERGE,
+                       n_rep=2000, method="poisson", chunk_size=250, n_workers=None, seed=None):
+    """
+    Bootstrap replicas of merged raw and unfolded gamma-rays multiplicities,
+    resampling the raw SCONE counts of each coincidence window. The windows are
+    merged with the weights of the nominal measurements (fixed across replicas),
+    and replicas are processed in vectorized chunks spread over a process pool.
+
+    Args:
+        filenames (tuple of str): SCONE files of the two coincidence windows.
+        merg (int): Merging index of the "cut" method. Defaults to 3.
+        merge (str): Merging method of the windows ("cut", "ivw" or "best", see merge_weights). Defaults to MERGE.
+        n_rep (int): Number of replicas. Defaults to 2000.
+        method (str): "poisson" or "multinomial". Defaults to "poisson".
+        chunk_size (int): Number of replicas per task. Defaults to 250.
+        n_workers (int or None): Number of processes (1 runs in-process). Defaults to None (all CPUs).
+        seed (int or None): Random generator seed. Defaults to None.
+
+    Returns:
+        (narray): Incident neutron energies [MeV].
+        (narray): Merged raw multiplicities replicas, shape (n_rep, energies).
+        (narray): Unfolded multiplicities replicas, shape (n_rep, energies).
+    """
+
+    # raw counts of each window
+
+    counts = []
+    for fname in filenames:
+        energies, mult, c = scone_counts(fname)
+        counts.append(np.asarray(c[:, ENERGY_BINS]))
+    energies = energies[ENERGY_BINS]
+
+    # merging weights of the nominal measurements
+
+    errors = [scone_meas(fname)[2] for fname in filenames]
+    weights = merge_weights(errors, method=merge, merg=merg)
+
+    # shared constants (fitted once, in the parent process)
+
+    *resp, c, p0, p1 = ENV.params_at(energies)[0]
+    n_contam, _ = neutron_contamination(c, 0., ENV.nubar_jeff, ENV.nubar_jeff_err)
+    pileup = ng_pileup(energies, p0, p1)
+
+    # tasks
+
+    sizes = [min(chunk_size, n_rep - i) for i in range(0, n_rep, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(counts, mult, weights, n, s, method, resp, n_contam, pileup) for n, s in zip(sizes, seeds)]
+
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    if n_workers == 1 or len(tasks) == 1:
+        results = list(map(_replica_chunk, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_replica_chunk, tasks))
+
+    g_mult_raw = np.concatenate([r[0] for r in results])
+    g_mult = np.concatenate([r[1] for r in results])
+
+    return energies, g_mult_raw, g_mult
+
+
+def bootstrap_errors(replicas):
+    """
+    Empirical errors of any quantity computed replica by replica.
+
+    Args:
+        replicas (narray): Replicas of a quantity, shape (n_rep, ...).
+
+    Returns:
+        (narray): 1-sigma errors, shape (...).
+        (narray): Covariance matrix of the flattened quantity.
+    """
+    replicas = np.asarray(replicas, dtype=float)
+    shape = replicas.shape[1:]
+    replicas = replicas.reshape(len(replicas), -1)
+    replicas = replicas[np.isfinite(replicas).all(axis=1)]
+    cov = np.atleast_2d(np.cov(replicas, rowvar=False))
+    return np.sqrt(np.diag(cov)).reshape(shape), cov
@@ -0,0 +1,107 @@
+""" On-disk cache functions """
+
+
+# librairies
+
+
+import os
+import json
+import hashlib
+import numpy as np
+from utils import CACHE_DIR
+
+
+# cache format version (bump to invalidate every stored entry)
+
+
+CACHE_VERSION = 1
+
+
+# functions
+
+
+def file_hash(filepath, chunk_size=1 << 20):
+    """
+    SHA-256 digest of a file content.
+
+    Args:
+        filepath (str or Path): Path to the file.
+        chunk_size (int): Size of the read chunks [bytes].
+
+    Returns:
+        (str): Hexadecimal digest.
+    """
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(*parts):
+    """
+    Build a cache key from JSON-serializable parts (file hashes, settings...).
+
+    Args:
+        *parts: Values identifying the cached result.
+
+    Returns:
+        (str): Hexadecimal key.
+    """
+    payload = json.dumps([CACHE_VERSION, *parts], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cache_path(name, key):
+    """
+    Path of a cache entry.
+
+    Args:
+        name (str): Family of the cached result (e.g. "scone_gconst").
+        key (str): Key from cache_key.
+
+    Returns:
+        (Path): Path of the .npz entry.
+    """
+    return CACHE_DIR / f"{name}_{key[:20]}.npz"
+
+
+def cache_load(name, key):
+    """
+    Load a cache entry.
+
+    Args:
+        name (str): Family of the cached result.
+        key (str): Key from cache_key.
+
+    Returns:
+        (dict or None): Stored arrays, None if missing or unreadable.
+    """
+    path = cache_path(name, key)
+    if not path.exists():
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            return {k: data[k] for k in data.files}
+    except (OSError, ValueError):
+        return None
+
+
+def cache_save(name, key, **arrays):
+    """
+    Store arrays in a cache entry (atomic write).
+
+    Args:
+        name (str): Family of the cached result.
+        key (str): Key from cache_key.
+        **arrays (narray): Arrays to store.
+
+    Returns:
+        (Path): Path of the .npz entry.
+    """
+    path = cache_path(name, key)
+    os.makedirs(path.parent, exist_ok=True)
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+    return path
@@ -0,0 +1,116 @@
+""" Energy-dependent neutron contamination of SCONE assemblies """
+
+# librairies
+
+import numpy as np
+from utils import *
+from env import C_ENERGY
+from cache import file_hash, cache_key, cache_load, cache_save
+
+# evaluated prompt fission neutron spectra of 238U (outgoing energy [eV] x incident energy [MeV])
+
+NEUTRON_SPECTRA_FILE = EVAL_DIR/"eval_distrib_energie_neutrons_fission_238U.csv"
+
+# functions
+
+
+def read_neutron_spectra(filepath=NEUTRON_SPECTRA_FILE):
+    """
+    Read evaluated prompt fission neutron spectra.
+
+    Args:
+        filepath (str or Path): CSV file, first row of incident energies [MeV] after an
+            empty first column, then rows of outgoing energy [eV] and spectra.
+
+    Returns:
+        (narray): Outgoing neutron energies [MeV].
+        (narray): Incident neutron energies [MeV].
+        (narray): Spectra normalized to unit integral, shape (outgoing, incident).
+    """
+    data = np.loadtxt(filepath, delimiter=",")
+    incident = data[0, 1:]
+    outgoing = data[1:, 0] * 1e-6
+    spectra = data[1:, 1:]
+    spectra = spectra / (trapezoid_weights(outgoing) @ spectra)
+    return outgoing, incident, spectra
+
+
+def trapezoid_weights(x):
+    """
+    Trapezoidal quadrature weights of a grid: w @ f is the integral of f sampled on x.
+
+    Args:
+        x (narray): Increasing grid.
+
+    Returns:
+        (narray): Weights, same shape as x.
+    """
+    dx = np.diff(x)
+    weights = np.zeros_like(x, dtype=float)
+    weights[:-1] += 0.5 * dx
+    weights[1:] += 0.5 * dx
+    return weights
+
+
+def spectra_matrix(energies, filepath=NEUTRON_SPECTRA_FILE, use_cache=True):
+    """
+    Quadrature matrix of the neutron spectra at given incident energies:
+    M @ eps is the spectrum-averaged value of a curve eps sampled on the
+    outgoing energies. Spectra are linearly interpolated between evaluated
+    incident energies (constant beyond). Cached on disk.
+
+    Args:
+        energies (narray): Incident neutron energies [MeV].
+        filepath (str or Path): Evaluated spectra file.
+        use_cache (bool): Read and write the on-disk cache. Defaults to True.
+
+    Returns:
+        (narray): Outgoing neutron energies [MeV].
+        (narray): Matrix, shape (energies, outgoing).
+    """
+    energies = np.asarray(energies, dtype=float)
+    key = cache_key(file_hash(filepath), energies.tolist())
+
+    if use_cache:
+        cached = cache_load("neutron_spectra", key)
+        if cached is not None:
+            return cached["outgoing"], cached["matrix"]
+
+    outgoing, incident, spectra = read_neutron_spectra(filepath)
+
+    # trapezoidal weights of the outgoing grid
+
+    quad = trapezoid_weights(outgoing)
+
+    # interpolation in incident energy (energies, incident)
+
+    weights = np.column_stack([np.interp(energies, incident, row) for row in np.eye(incident.size)])
+    matrix = (weights @ spectra.T) * quad
+
+    if use_cache:
+        cache_save("neutron_spectra", key, outgoing=outgoing, matrix=matrix)
+
+    return outgoing, matrix
+
+
+def contamination_factor(energies, efficiency, ref_energy=C_ENERGY, filepath=NEUTRON_SPECTRA_FILE):
+    """
+    Relative neutron contamination per incident energy: assembly efficiency
+    averaged over the prompt neutron spectrum, relative to its value at the
+    incident energy where C was calibrated, so that the contamination
+    constant becomes C(E) = C * factor(E) with factor(ref_energy) = 1.
+
+    Args:
+        energies (narray): Incident neutron energies [MeV].
+        efficiency (tuple): (neutron energies [MeV], efficiencies) of an
+            assembly, linearly interpolated (constant beyond); any scale.
+        ref_energy (float): Incident energy of the calibration of C [MeV]. Defaults to C_ENERGY.
+        filepath (str or Path): Evaluated spectra file.
+
+    Returns:
+        (narray): Contamination factor per incident energy.
+    """
+    energies = np.asarray(energies, dtype=float)
+    outgoing, matrix = spectra_matrix(np.append(energies, ref_energy), filepath)
+    averaged = matrix @ np.interp(outgoing, *efficiency)
+    return averaged[:-1] / averaged[-1]
@@ -0,0 +1,200 @@
+""" Incremental pipeline: stages cached on disk under the hash of their inputs, parameters and code """
+
+# librairies
+
+import sys
+import inspect
+import hashlib
+import importlib
+import numpy as np
+from pathlib import Path
+from cache import file_hash, cache_key, cache_load, cache_save
+from profiling import stage, attach
+
+# class
+
+
+class Step:
+    """
+    Stage of a pipeline. Its outputs (a dict of arrays) are cached on disk
+    under a key built from the keys of the stages it depends on, the content
+    of the files it reads, its parameters, the values of the env.py settings
+    it uses and the source of the modules implementing it, so that it only
+    runs again when one of them changes.
+
+    Args:
+        name (str): Name of the stage (also its profiling stage).
+        func (callable): Module-level function of the outputs of deps (dicts,
+            in order) and of params (keywords), returning a dict of arrays.
+        deps (tuple of str): Names of the stages whose outputs are needed. Defaults to ().
+        params (dict or None): Keyword arguments of func. Defaults to None.
+        files (tuple of Path): Data files read by the stage. Defaults to ().
+        env (tuple of str): Names of the env.py settings read by the stage. Defaults to ().
+        code (tuple of str): Names of the modules implementing the stage, or of
+            objects ("module.object") for modules also holding settings. Defaults to ().
+        products (tuple of Path): Files written by the stage (run again if missing or
+            modified since). Defaults to ().
+        render (bool): Figure stage, submitted to the figure pool of the run if any. Defaults to False.
+    """
+
+    def __init__(self, name, func, deps=(), params=None, files=(), env=(), code=(), products=(), render=False):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = params or {}
+        self.files = tuple(Path(f) for f in files)
+        self.env = tuple(env)
+        self.code = tuple(code)
+        self.products = tuple(Path(p) for p in products)
+        self.render = render
+
+    def key(self, dep_keys):
+        """
+        Content-addressed key of the stage.
+
+        Args:
+            dep_keys (list of str): Keys of the stages in deps.
+
+        Returns:
+            (str): Hexadecimal key.
+        """
+        env = sys.modules["env"]
+        return cache_key(
+            self.name, f"{self.func.__module__}.{self.func.__qualname__}",
+            list(dep_keys),
+            [file_hash(f) for f in self.files],
+            _jsonable(self.params),
+            {name: _jsonable(getattr(env, name)) for name in self.env},
+            {name: code_hash(name) for name in self.code},
+        )
+
+
+class Pipeline:
+    """
+    Stages run in dependency order, each one loaded from the on-disk cache
+    when its key is unchanged and its products are the ones it wrote.
+
+    Args:
+        steps (list of Step): Stages, any order.
+        use_cache (bool): Read the cache (stages are always stored). Defaults to True.
+    """
+
+    def __init__(self, steps, use_cache=True):
+        self.steps = {s.name: s for s in steps}
+        self.use_cache = use_cache
+        self.keys = {}
+        self.status = {}
+
+    def order(self):
+        """
+        Names of the stages in a dependency order (depth-first, as declared).
+        """
+        done, order = set(), []
+
+        def visit(name, path=()):
+            if name in path:
+                raise ValueError(f"Dependency cycle: {' -> '.join(path + (name,))}")
+            if name in done:
+                return
+            for dep in self.steps[name].deps:
+                visit(dep, path + (name,))
+            done.add(name)
+            order.append(name)
+
+        for name in self.steps:
+            visit(name)
+        return order
+
+    def run(self, figures=None):
+        """
+        Run the invalidated stages and load the others.
+
+        Args:
+            figures (FigurePool or None): Pool of the render stages (run in-process
+                if None). Their cache entries are written once the figures are done.
+
+        Returns:
+            (dict): Outputs of each stage, by name.
+        """
+        outputs, rendered = {}, []
+
+        for name in self.order():
+            step = self.steps[name]
+            key = self.keys[name] = step.key([self.keys[d] for d in step.deps])
+            args = [outputs[d] for d in step.deps]
+
+            if self.use_cache:
+                cached = cache_load(f"step_{name}", key)
+                if cached is not None and _products_match(step, cached.pop("products")):
+                    outputs[name], self.status[name] = cached, "cached"
+                    continue
+
+            self.status[name] = "run"
+            if step.render and figures is not None:
+                figures.submit(step.func, *args, **step.params)
+                outputs[name] = {}
+                rendered.append(name)
+                continue
+
+            with stage(name) as st:
+                result = step.func(*args, **step.params)
+                outputs[name] = {} if step.render else {k: np.asarray(v) for k, v in result.items()}
+                st.record(**outputs[name])
+            cache_save(f"step_{name}", key, products=_products_hash(step), **outputs[name])
+
+        if rendered:
+            with stage("render"):
+                figures.results()
+                attach(figures.records())
+            for name in rendered:
+                cache_save(f"step_{name}", self.keys[name], products=_products_hash(self.steps[name]))
+
+        return outputs
+
+
+# functions
+
+
+def code_hash(name):
+    """
+    SHA-256 digest of the source file of a module, or of the source of one
+    of its objects (e.g. "env.LazyEnv", the code of a settings file).
+
+    Args:
+        name (str): Module name, or "module.object".
+
+    Returns:
+        (str): Hexadecimal digest.
+    """
+    module, _, obj = name.partition(".")
+    module = importlib.import_module(module)
+    if not obj:
+        return file_hash(module.__file__)
+    return hashlib.sha256(inspect.getsource(getattr(module, obj)).encode()).hexdigest()
+
+
+def _products_hash(step):
+    """
+    Digests of the products of a stage.
+    """
+    return np.array([file_hash(p) for p in step.products], dtype="U64")
+
+
+def _products_match(step, digests):
+    """
+    Whether the products of a stage exist with the given digests.
+    """
+    return all(p.exists() for p in step.products) and np.array_equal(_products_hash(step), digests)
+
+
+def _jsonable(value):
+    """
+    Arrays and tuples as (nested) lists, for cache keys.
+    """
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return value
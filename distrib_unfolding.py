@@ -0,0 +1,163 @@
+""" Full-distribution unfolding functions """
+
+# librairies
+
+import numpy as np
+from scipy.stats import poisson
+from env import *
+from response import fission_gcasc_matrix
+from unfolding import neutron_contamination, ng_pileup
+from moments import issparse
+
+# functions
+
+
+def neutron_kernel(detected_mult, n_mean):
+    """
+    Poisson smearing of the detected multiplicity by neutron hits.
+
+    Args:
+        detected_mult (narray): Detected multiplicity axis (consecutive integers).
+        n_mean (narray): Average number of extra assemblies fired by neutrons, per energy.
+
+    Returns:
+        (narray): Kernel K[e, k] = P(k neutron hits), k = 0 .. detected - 1, shape (energies, detected).
+            The smearing matrix K[e, d, d'] = K[e, d - d'] is lower triangular Toeplitz
+            and applied as a convolution, never built.
+    """
+    shift = np.arange(len(detected_mult))
+    n_mean = np.clip(np.asarray(n_mean, dtype=float), 0., None)
+    return poisson.pmf(shift[None, :], n_mean[:, None])
+
+
+def _smear(kernel, x):
+    """
+    Neutron smearing of detected spectra x (energies, detected): y[e, d] = sum_k K[e, k] x[e, d - k].
+    """
+    y = np.zeros_like(x)
+    for k in range(x.shape[1]):
+        y[:, k:] += kernel[:, k, None] * x[:, :x.shape[1] - k]
+    return y
+
+
+def _smear_transpose(kernel, y):
+    """
+    Transpose of _smear: x[e, d] = sum_k K[e, k] y[e, d + k].
+    """
+    x = np.zeros_like(y)
+    for k in range(y.shape[1]):
+        x[:, :y.shape[1] - k] += kernel[:, k, None] * y[:, k:]
+    return x
+
+
+def bayes_unfolding(counts, resp, n_iter=4, prior=None, tol=None, kernel=None):
+    """
+    Iterative Bayesian (D'Agostini) unfolding of every energy column at once.
+
+    Args:
+        counts (narray or sparse array): Measured counts, shape (detected, energies).
+        resp (narray or sparse array): P(detected | emitted), shape (detected, emitted),
+            or (energies, detected, emitted) for an energy-dependent response (dense only).
+        n_iter (int): Maximum number of iterations (regularization). Defaults to 4.
+        prior (narray or None): Initial emitted distribution, shape (emitted,) or
+            (emitted, energies). Defaults to None (uniform).
+        tol (float or None): Stop when the distributions change by less than tol. Defaults to None.
+        kernel (narray or None): Energy-dependent smearing of the detected multiplicity
+            applied after resp (see neutron_kernel), shape (energies, detected). It is
+            applied on the fly, so that resp is never multiplied out. Defaults to None.
+
+    Returns:
+        (narray): Unfolded emitted distributions, shape (emitted, energies), normalized per energy.
+    """
+
+    # energy-major layout (counts are densified: they have the size of the
+    # folded spectra of each iteration, unlike the response)
+
+    n = (counts.toarray() if issparse(counts) else np.asarray(counts, dtype=float)).T
+    n_emitted = resp.shape[-1]
+
+    # folding (emitted -> detected) and back-projection (detected -> emitted)
+
+    if resp.ndim == 3:
+        fold = lambda x: np.matmul(resp, x[..., None])[..., 0]
+        back = lambda y: np.matmul(y[:, None, :], resp)[:, 0, :]
+    else:
+        fold = lambda x: np.asarray(resp @ x.T).T
+        back = lambda y: np.asarray(resp.T @ y.T).T
+    if kernel is not None:
+        fold_resp, back_resp = fold, back
+        fold = lambda x: _smear(kernel, fold_resp(x))
+        back = lambda y: back_resp(_smear_transpose(kernel, y))
+
+    eff = back(np.ones_like(n))
+
+    if prior is None:
+        p = np.full((n.shape[0], n_emitted), 1. / n_emitted)
+    else:
+        p = np.broadcast_to(np.asarray(prior, dtype=float).T, (n.shape[0], n_emitted))
+        p = p / p.sum(axis=1, keepdims=True)
+
+    # iterations
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(n_iter):
+            folded = fold(p)
+            ratio = np.where(folded > 0, n / folded, 0.)
+            p_new = np.where(eff > 0, p * back(ratio) / eff, 0.)
+            p_new = p_new / p_new.sum(axis=1, keepdims=True)
+            converged = tol is not None and np.nanmax(np.abs(p_new - p)) < tol
+            p = p_new
+            if converged:
+                break
+
+    return p.T
+
+
+def g_distrib_unfolding(filename, filenames=FILENAMES, n_iter=4, neutrons=True, sparse=False):
+    """
+    Emitted gamma-rays multiplicity distribution unfolded from SCONE measurements
+    with the Geant4 response matrix, for every incident energy.
+
+    Args:
+        filename (str): Name of the SCONE file from low-level analysis.
+        filenames (list of str): Geant4 simulation filenames of the response matrix.
+        n_iter (int): Number of Bayesian iterations. Defaults to 4.
+        neutrons (bool): Fold neutron contamination and pile-up in the response. Defaults to True.
+        sparse (bool): Read the count and response matrices as sparse; the response
+            stays sparse, the counts are densified for the iterations. Defaults to False.
+
+    Returns:
+        (narray): Incident neutron energies [MeV].
+        (narray): Emitted gamma-rays multiplicities.
+        (narray): Unfolded distributions P(M), shape (emitted, energies).
+        (narray): Average emitted gamma-rays multiplicities.
+        (narray): Variance of emitted gamma-rays multiplicities.
+    """
+
+    # measurements
+
+    energies, mult, counts = scone_counts(filename, sparse=sparse)
+    energies, counts = energies[ENERGY_BINS], counts[:, ENERGY_BINS]
+
+    # response restricted to measured multiplicities
+
+    emitted, detected, resp = fission_gcasc_matrix(filenames, sparse=sparse)
+    if not np.isin(mult, detected).all():
+        raise ValueError("Measured multiplicities outside of the Geant4 detected axis")
+    resp = resp[np.searchsorted(detected, mult), :]
+
+    # neutron hits (contamination minus pile-up losses)
+
+    kernel = None
+    if neutrons:
+        *_, c, p0, p1 = ENV.params_at(energies)[0]
+        n_contam, _ = neutron_contamination(c, 0., ENV.nubar_jeff, ENV.nubar_jeff_err)
+        kernel = neutron_kernel(mult, n_contam - ng_pileup(energies, p0, p1))
+
+    # unfolding
+
+    p = bayes_unfolding(counts, resp, n_iter=n_iter, kernel=kernel)
+    mean = emitted @ p
+    var = (emitted**2) @ p - mean**2
+
+    return energies, emitted, p, mean, var
@@ -1,15 +1,16 @@
 """ Global environment variables and data"""
 
-# librairies 
+# librairies
 
+from functools import cached_property
 from utils import *
-from response import fit_scone_gconst_multiple
+from models import MODELS
 
 # plots font size
 
 FONT_SIZE = 30
 
-# physics constants 
+# physics constants
 
 SN = 0.5
 SNU_MIN = 0.0
@@ -24,31 +25,277 @@ FILENAMES = [
     "Geant4_FIFRELIN_252Cf.txt"
     ]
 
-# SCONE constants 
+# energy-dependent response: (A, B) fitted on each neutron-induced fission file
+# of RESPONSE_FILES for the target RESPONSE_TARGET and interpolated in incident
+# energy (optionally for one cascade generator only)
+
+ENERGY_RESPONSE = False
+RESPONSE_TARGET = "238U"
+RESPONSE_GENERATOR = None
+RESPONSE_FILES = FILENAMES + [
+    "Geant4_GEF_238U_10MeV.txt",
+    "Geant4_GEF_239Pu_15MeV.txt"
+    ]
+
+# energy-dependent neutron contamination: C(E) = C x assembly efficiency
+# (NEUTRON_EFFICIENCY: neutron energies [MeV], efficiencies) averaged over the
+# evaluated prompt neutron spectrum of each incident energy, relative to its
+# value at the incident energy where C was calibrated (C_ENERGY [MeV])
+
+ENERGY_CONTAMINATION = False
+NEUTRON_EFFICIENCY = ([0., 20.], [1., 1.])
+C_ENERGY = 1.
+
+# grid of energy-dependent tables: SCONE 1 MeV bins
+
+TABLE_ENERGIES = np.arange(0., 50.)
+
+# merging of coincidence windows: "cut" (at a fixed bin), "ivw" (inverse-variance) or "best"
+
+MERGE = "cut"
+
+# SCONE constants (A, B are fitted lazily, see LazyEnv)
 
-A, B, DA, DB = fit_scone_gconst_multiple(FILENAMES)
 C, DC = 0.33, 0.01
 
+# neutron-gamma pile-up line P0 + P1*(E - 1 MeV) and its 1-sigma errors (0 = fixed)
+
+PILEUP, DPILEUP = (0.15, 0.4/30), (0.0, 0.0)
+
+# response model of SCONE to fission cascades (name in models.MODELS, e.g. "exp",
+# "exp_lin", "exp_pileup"), fitted on the Geant4 files and inverted by the unfolding
+
+RESPONSE_MODEL = "exp"
+
+# unfolding parameters (model parameters, then C, P0, P1; A, B, C, P0, P1 for "exp")
+# from a joint global fit instead of separate ones
+
+GLOBAL_FIT = False
+PARAM_NAMES = (*(name.upper() for name in MODELS[RESPONSE_MODEL].param_names), "C", "P0", "P1")
+N_RESPONSE = MODELS[RESPONSE_MODEL].n_params
+
 # Microscopic calculations result for angular momentum transfer to fragments
 
 FRAG_MOM_MICRO = 0.3
 
-# evaluations : nubar JEFF-4.1
 
-_, _, nubar_jeff, nubar_jeff_err = csv_data_reader(EVAL_DIR/"238U_nubar_JEFF4.csv")
+# lazy constants and data
+
+
+class LazyEnv:
+    """
+    Lazily evaluated SCONE constants and reference datasets.
+
+    Each attribute is computed on first access and memoized, so that importing
+    this module neither reads files nor runs the Geant4 fit.
+    """
+
+    # lazy attributes computed from other ones (dropped when those are primed)
+
+    DERIVED = {"response": ("unfolding_params",)}
+
+    def prime(self, **values):
+        """
+        Set lazy attributes to already computed values (e.g. response=ResponseDataset),
+        dropping the memoized attributes derived from them.
+        """
+        for name in values:
+            for derived in self.DERIVED.get(name, ()):
+                self.__dict__.pop(derived, None)
+        self.__dict__.update(values)
+
+    def state(self, *names):
+        """
+        Memoized values of some lazy attributes (the ones already computed), for prime.
+        """
+        return {name: self.__dict__[name] for name in names if name in self.__dict__}
+
+    # SCONE constants
+
+    @cached_property
+    def response(self):
+        from response import ResponseDataset
+        return ResponseDataset(FILENAMES)
+
+    @property
+    def scone_fit(self):
+        return self.response.popt, self.response.pcov, self.response.curves
+
+    @property
+    def scone_gconst(self):
+        return self.response.gconst
+
+    @property
+    def A(self):
+        return self.response.popt[0]
+
+    @property
+    def B(self):
+        return self.response.popt[1]
+
+    @property
+    def DA(self):
+        return np.sqrt(self.response.pcov[0, 0])
+
+    @property
+    def DB(self):
+        return np.sqrt(self.response.pcov[1, 1])
+
+    @property
+    def AB_COV(self):
+        return self.scone_fit[1]
+
+    # unfolding parameters vector (PARAM_NAMES) and covariance
+
+    @cached_property
+    def unfolding_params(self):
+        if GLOBAL_FIT:
+            from globalfit import global_fit
+            return global_fit(FILENAMES, response=self.response)
+        k = N_RESPONSE
+        params = np.array([*self.response.popt, C, *PILEUP])
+        cov = np.zeros((k + 3, k + 3))
+        cov[:k, :k] = self.response.pcov
+        cov[k:, k:] = np.diag(np.array([DC, *DPILEUP])**2)
+        return params, cov
+
+    @property
+    def params(self):
+        return self.unfolding_params[0]
+
+    @property
+    def params_cov(self):
+        return self.unfolding_params[1]
+
+    # energy-dependent tables on TABLE_ENERGIES: response parameters and contamination factor
+
+    @cached_property
+    def response_table(self):
+        from response import response_table
+        return response_table(TABLE_ENERGIES, RESPONSE_FILES, target=RESPONSE_TARGET, generator=RESPONSE_GENERATOR)
+
+    @cached_property
+    def contamination_table(self):
+        from contamination import contamination_factor
+        return contamination_factor(TABLE_ENERGIES, NEUTRON_EFFICIENCY)
+
+    def params_at(self, energies):
+        """
+        Unfolding parameters and covariances for some incident energies:
+        (params, params_cov) if ENERGY_RESPONSE and ENERGY_CONTAMINATION are off,
+        otherwise per-energy parameters (PARAM_NAMES, energies) and covariances
+        (energies, PARAM_NAMES, PARAM_NAMES) with the response parameters
+        and/or C looked up in the tables at the nearest grid point.
+        """
+        if not (ENERGY_RESPONSE or ENERGY_CONTAMINATION):
+            return self.params, self.params_cov
+        energies = np.atleast_1d(np.asarray(energies, dtype=float))
+        i = np.abs(energies[:, None] - TABLE_ENERGIES).argmin(axis=1)
+        params = np.repeat(self.params[:, None], energies.size, axis=1)
+        cov = np.repeat(self.params_cov[None], energies.size, axis=0)
+        k = N_RESPONSE
+        if ENERGY_RESPONSE:
+            *resp, resp_cov = self.response_table
+            params[:k] = np.array(resp)[:, i]
+            cov[:, :k, :], cov[:, :, :k] = 0., 0.
+            cov[:, :k, :k] = resp_cov[i]
+        if ENERGY_CONTAMINATION:
+            factor = self.contamination_table[i]
+            params[k] *= factor
+            cov[:, k, :] *= factor[:, None]
+            cov[:, :, k] *= factor[:, None]
+        return params, cov
+
+    # evaluations : nubar JEFF-4.1
+
+    @cached_property
+    def jeff(self):
+        return csv_data_reader(EVAL_DIR/"238U_nubar_JEFF4.csv")
+
+    @property
+    def nubar_jeff(self):
+        return self.jeff[2]
+
+    @property
+    def nubar_jeff_err(self):
+        return self.jeff[3]
+
+    # literature data : Qi
+
+    @cached_property
+    def qi(self):
+        return csv_data_reader(LIT_DIR/"Qi_200keV_data.csv")
+
+    @property
+    def qi_energies(self):
+        return self.qi[0]
+
+    @property
+    def qi_mult(self):
+        return self.qi[2]
+
+    @property
+    def qi_mult_err(self):
+        return self.qi[3]
+
+    # literature data: Laborie
+
+    @cached_property
+    def laborie(self):
+        return csv_data_reader(LIT_DIR/"Laborie_190keV_data.csv")
+
+    @property
+    def laborie_energies(self):
+        return self.laborie[0]
+
+    @property
+    def laborie_energies_err(self):
+        return self.laborie[1]
+
+    @property
+    def laborie_mult(self):
+        return self.laborie[2]
+
+    @property
+    def laborie_mult_err(self):
+        return self.laborie[3]
+
+    # simulations: CGMF
+
+    @cached_property
+    def cgmf(self):
+        return csv_data_reader(SIMU_DIR/"238U_CGMF_200keV.csv")
+
+    @property
+    def cgmf_energies(self):
+        return self.cgmf[0]
+
+    @property
+    def cgmf_mult(self):
+        return self.cgmf[2]
 
-# literature data : Qi
+    # simulations: GEF
 
-qi_energies, _, qi_mult, qi_mult_err = csv_data_reader(LIT_DIR/"Qi_200keV_data.csv")
+    @cached_property
+    def gef(self):
+        return csv_data_reader(SIMU_DIR/"238U_GEF_200keV.csv")
 
-# literature data: Laborie
+    @property
+    def gef_energies(self):
+        return self.gef[0]
 
-laborie_energies, laborie_energies_err, laborie_mult, laborie_mult_err = csv_data_reader(LIT_DIR/"Laborie_190keV_data.csv")
+    @property
+    def gef_mult(self):
+        return self.gef[2]
 
-# simulations: CGMF
 
-cgmf_energies, _, cgmf_mult, _ = csv_data_reader(SIMU_DIR/"238U_CGMF_200keV.csv")
+ENV = LazyEnv()
 
-# simulations: GEF
 
-gef_energies, _, gef_mult, _ = csv_data_reader(SIMU_DIR/"238U_GEF_200keV.csv")
\ No newline at end of file
+def __getattr__(name):
+    """
+    Module-level access to lazy names (e.g. env.A, env.nubar_jeff).
+    """
+    if not name.startswith('_') and hasattr(LazyEnv, name):
+        return getattr(ENV, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,152 @@
+""" Joint global fit of the unfolding parameters (A, B, C, P0, P1) """
+
+# librairies
+
+import numpy as np
+from scipy.optimize import least_squares
+from env import *
+from models import MODELS
+from response import fission_gcasc_resp
+
+# functions
+
+
+def _residuals(theta, blocks, model):
+    """
+    Weighted residuals of all fit blocks and their analytic Jacobian.
+
+    Args:
+        theta (narray): Parameters (PARAM_NAMES).
+        blocks (dict): Data blocks built by global_fit.
+        model (ResponseModel): Response model of the Geant4 curves.
+
+    Returns:
+        (narray): Residuals.
+        (narray): Jacobian, shape (residuals, parameters).
+    """
+    *resp, c, p0, p1 = theta
+    k = model.n_params
+    res, jac = [], []
+
+    # Geant4 response curves: detected = model.forward(x, *resp)
+
+    x, y, sigma = blocks["geant4"]
+    res.append((model.forward(x, *resp) - y) / sigma)
+    jac.append(np.column_stack([model.jac(x, *resp).reshape(-1, k), np.zeros((x.size, 3))]) / sigma)
+
+    # direct measurements (or priors) of parameters
+
+    index, values, errors = blocks["params"]
+    res.append((theta[index] - values) / errors)
+    jac.append(np.eye(k + 3)[index] / errors[:, None])
+
+    # pile-up measurements: P0 + P1*(E - 1)
+
+    en, values, errors = blocks["pileup"]
+    res.append((p0 + p1 * (en - 1.) - values) / errors)
+    jac.append(np.column_stack([np.zeros((en.size, k + 1)), np.ones_like(en), en - 1.]) / errors[:, None])
+
+    # reference raw multiplicities of known emitted multiplicities
+
+    en, raw, raw_err, true, nubar = blocks["ref"]
+    res.append((model.forward(true, *resp) + c * nubar - (p0 + p1 * (en - 1.)) - raw) / raw_err)
+    jac.append(np.column_stack([model.jac(true, *resp).reshape(-1, k), nubar, -np.ones_like(en), -(en - 1.)]) / raw_err[:, None])
+
+    return np.concatenate(res), np.concatenate(jac)
+
+
+def global_fit(filenames=FILENAMES, mult_range=None, c_calib=None, pileup_calib=None, ref_calib=None, g4_sigma=None, response=None,
+               model=RESPONSE_MODEL):
+    """
+    Joint fit of the SCONE response constants (A, B for "exp"), the neutron constant C
+    and the pile-up line (P0, P1) on the Geant4 response curves and calibration
+    measurements, with analytic gradients. Without calibration data, C and the
+    pile-up line are constrained by their values in env.py (C, DC, PILEUP, DPILEUP);
+    parameters with neither data nor prior error are kept fixed.
+
+    Args:
+        filenames (list of str): Geant4 simulation filenames.
+        mult_range (tuple or None): (min, max) range of emitted multiplicity to keep. Defaults to None.
+        c_calib (tuple or None): (values, errors) of C measurements. Defaults to None.
+        pileup_calib (tuple or None): (energies, values, errors) of pile-up measurements. Defaults to None.
+        ref_calib (tuple or None): (energies, g_mult_raw, g_mult_raw_err, g_mult_true, nubar)
+            of raw SCONE multiplicities for known emitted multiplicities. Defaults to None.
+        g4_sigma (float or None): Error of Geant4 average detected multiplicities.
+            Defaults to None (estimated from the residuals, as curve_fit does).
+        response (ResponseDataset or None): Already loaded Geant4 curves (filenames and
+            mult_range are then ignored). Defaults to None.
+        model (str): Response model of MODELS. Defaults to RESPONSE_MODEL.
+
+    Returns:
+        (narray): Fitted parameters (PARAM_NAMES).
+        (narray): Covariance matrix of the parameters.
+    """
+
+    model = MODELS[model]
+    k = model.n_params
+
+    # data blocks
+
+    if response is not None:
+        curves = response.curves
+    else:
+        curves = [fission_gcasc_resp(fname, mult_range=mult_range) for fname in filenames]
+    x = np.concatenate([x for x, _ in curves])
+    y = np.concatenate([y for _, y in curves])
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+
+    empty = np.zeros(0)
+    blocks = {
+        "geant4": (x, y, 1. if g4_sigma is None else g4_sigma),
+        "params": (np.zeros(0, dtype=int), empty, empty),
+        "pileup": tuple(np.atleast_1d(v) for v in pileup_calib) if pileup_calib is not None else (empty,) * 3,
+        "ref": tuple(np.atleast_1d(v) for v in ref_calib) if ref_calib is not None else (empty,) * 5,
+    }
+
+    # C measurements, or priors of env.py when no calibration data
+
+    if c_calib is not None:
+        values, errors = np.atleast_1d(c_calib[0]), np.atleast_1d(c_calib[1])
+        priors = [(k, v, e) for v, e in zip(values, errors)]
+    else:
+        priors = [(k, C, DC)]
+    if pileup_calib is None:
+        priors += [(k + 1, PILEUP[0], DPILEUP[0]), (k + 2, PILEUP[1], DPILEUP[1])]
+    priors = [(i, v, e) for i, v, e in priors if e > 0]
+    if priors:
+        index, values, errors = map(np.array, zip(*priors))
+        blocks["params"] = (index.astype(int), values.astype(float), errors.astype(float))
+
+    # free parameters (constrained by at least one residual)
+
+    theta0 = np.array([*model.p0, C, *PILEUP])
+    free = np.abs(_residuals(theta0, blocks, model)[1]).sum(axis=0) > 0
+
+    def fun(t):
+        theta = theta0.copy()
+        theta[free] = t
+        res, jac = _residuals(theta, blocks, model)
+        return res, jac[:, free]
+
+    lower = np.concatenate([model.lower, np.full(3, -np.inf)])[free]
+    upper = np.concatenate([model.upper, np.full(3, np.inf)])[free]
+    sol = least_squares(lambda t: fun(t)[0], theta0[free], jac=lambda t: fun(t)[1], bounds=(lower, upper), method='trf')
+
+    # Geant4 error estimated from the residuals, then refit
+
+    if g4_sigma is None:
+        n_g4 = x.size
+        s2 = np.sum(sol.fun[:n_g4]**2) / (n_g4 - k)
+        blocks["geant4"] = (x, y, np.sqrt(s2))
+        sol = least_squares(lambda t: fun(t)[0], sol.x, jac=lambda t: fun(t)[1], bounds=(lower, upper), method='trf')
+
+    # covariance
+
+    params = theta0.copy()
+    params[free] = sol.x
+    jac = fun(sol.x)[1]
+    cov = np.zeros((k + 3, k + 3))
+    cov[np.ix_(free, free)] = np.linalg.pinv(jac.T @ jac)
+
+    return params, cov
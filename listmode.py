@@ -0,0 +1,123 @@
+""" Streaming reader of SCONE list-mode files """
+
+# librairies
+
+import numpy as np
+from pathlib import Path
+from utils import *
+
+# list-mode records: incident energy from time of flight [MeV], number of assemblies fired
+
+LISTMODE_DTYPE = np.dtype([('energy', '<f4'), ('mult', '<u2')])
+
+# default binning of SCONE measurements: 1 MeV bins centred on 0, 1, ... 49 MeV
+
+ENERGY_EDGES = np.arange(-0.5, 50.5, 1.)
+N_MULT = 31
+
+# functions
+
+
+def iter_listmode(filepath, chunk_size=1 << 22, offset=0, binary=None, dtype=LISTMODE_DTYPE):
+    """
+    Iterate over a list-mode file by fixed-size chunks of records.
+
+    Args:
+        filepath (str or Path): Path to the list-mode file.
+        chunk_size (int): Number of records per chunk. Defaults to 4194304.
+        offset (int): Number of records to skip. Defaults to 0.
+        binary (bool or None): Binary records (dtype) or text (two columns).
+            Defaults to None (binary for a ".bin" suffix).
+        dtype (np.dtype): Binary record type with 'energy' and 'mult' fields.
+
+    Yields:
+        (narray): Incident energies of the chunk.
+        (narray): Multiplicities of the chunk.
+    """
+    filepath = Path(filepath)
+    binary = filepath.suffix == ".bin" if binary is None else binary
+
+    if binary:
+        with open(filepath, 'rb') as f:
+            f.seek(offset * dtype.itemsize)
+            while True:
+                chunk = np.fromfile(f, dtype=dtype, count=chunk_size)
+                if chunk.size == 0:
+                    break
+                yield chunk['energy'], chunk['mult']
+    else:
+        import pandas as pd # text files only (slow import)
+
+        reader = pd.read_csv(filepath, sep=r"\s+", header=None, comment="#", names=["energy", "mult"],
+                             skiprows=offset, chunksize=chunk_size, dtype={"energy": float, "mult": np.int64})
+        for chunk in reader:
+            yield chunk["energy"].to_numpy(), chunk["mult"].to_numpy()
+
+
+def accumulate_counts(counts, energy, mult, energy_edges=ENERGY_EDGES):
+    """
+    Add list-mode records to a (multiplicity x energy) count matrix, in place.
+    Records outside the energy edges or the multiplicity range are dropped.
+
+    Args:
+        counts (narray): Count matrix, shape (multiplicities, energies), int64.
+        energy (narray): Incident energies of the records [MeV].
+        mult (narray): Multiplicities of the records.
+        energy_edges (narray): Incident energy bin edges [MeV].
+
+    Returns:
+        (narray): Indices of the energy bins touched by the records.
+    """
+    n_mult, n_e = counts.shape
+    width = np.diff(energy_edges)
+    if np.allclose(width, width[0]):
+        ie = np.floor((energy - energy_edges[0]) * (1. / width[0])).astype(np.int64)
+    else:
+        ie = np.searchsorted(energy_edges, energy, side='right') - 1
+    keep = (ie >= 0) & (ie < n_e) & (mult >= 0) & (mult < n_mult)
+    flat = (mult.astype(np.int64) * n_e + ie)[keep]
+    chunk = np.bincount(flat, minlength=n_mult * n_e).reshape(n_mult, n_e)
+    counts += chunk
+    return np.flatnonzero(chunk.any(axis=0))
+
+
+def listmode_matrix(filepath, energy_edges=ENERGY_EDGES, n_mult=N_MULT, chunk_size=1 << 22, binary=None):
+    """
+    Histogram a list-mode file into the (multiplicity x energy) count matrix
+    used by scone_meas, in constant memory whatever the file size.
+
+    Args:
+        filepath (str or Path): Path to the list-mode file.
+        energy_edges (narray): Incident energy bin edges [MeV]. Defaults to 1 MeV bins.
+        n_mult (int): Number of multiplicity bins (0 to n_mult-1). Defaults to 31.
+        chunk_size (int): Number of records per chunk.
+        binary (bool or None): See iter_listmode.
+
+    Returns:
+        (narray): Incident neutron energies (bin centres).
+        (narray): Multiplicity axis.
+        (narray): Counts, shape (multiplicities, energies).
+    """
+    counts = np.zeros((n_mult, len(energy_edges) - 1), dtype=np.int64)
+    for energy, mult in iter_listmode(filepath, chunk_size=chunk_size, binary=binary):
+        accumulate_counts(counts, energy, mult, energy_edges)
+    energies = 0.5 * (energy_edges[1:] + energy_edges[:-1])
+    return energies, np.arange(n_mult, dtype=float), counts
+
+
+def listmode_to_scone(filepath, filename, **kwargs):
+    """
+    Histogram a list-mode file into a SCONE triplet file of data/scone/,
+    readable by scone_meas.
+
+    Args:
+        filepath (str or Path): Path to the list-mode file.
+        filename (str): Name of the SCONE file to write in data/scone/.
+        **kwargs: Arguments of listmode_matrix.
+
+    Returns:
+        (Path): Path of the SCONE file.
+    """
+    energies, mult, counts = listmode_matrix(filepath, **kwargs)
+    write_triplets(SCONE_DIR/filename, energies, mult, counts)
+    return SCONE_DIR/filename
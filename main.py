@@ -5,9 +5,12 @@
 
 
 import os
+import argparse
 from env import *
-from unfolding import g_mult_unfolding
-from plots import plot_g_mult, plot_angmom, plot_ab_fit
+from dag import Pipeline
+from pipeline import analysis_steps
+from render import FigurePool
+from profiling import enable
 
 
 # run
@@ -15,35 +18,26 @@ from plots import plot_g_mult, plot_angmom, plot_ab_fit
 
 if __name__ == "__main__":
 
-    os.makedirs('outputs', exist_ok=True)
-    
-    # SCONE raw measurements at 56us 
-
-    energies, g_mult_raw_56us, stat_err_56us = scone_meas(filename = "238U_meas_mg_56us.csv")
-    
-    # SCONE raw measurements at 5.6us 
-
-    _, g_mult_raw_5us6, stat_err_5us6 = scone_meas(filename = "238U_meas_mg_5us6.csv")
-
-    # merging @ 4 MeV
-
-    merg = 3
-    g_mult_raw = np.concatenate((g_mult_raw_56us[:merg], g_mult_raw_5us6[merg:30]))
-    stat_err_raw = np.concatenate((stat_err_56us[:merg], stat_err_5us6[merg:30]))
+    parser = argparse.ArgumentParser(description="GASCONE main analysis")
+    parser.add_argument("--profile", nargs="?", const="", default=None,
+                        help="write a JSON profile of the run (default: outputs/profile_<date>_<time>.json)")
+    parser.add_argument("--rerun", action="store_true", help="run every stage again, ignoring the stage cache")
+    args = parser.parse_args()
+    if args.profile is not None:
+        enable(args.profile or None)
 
-    # A, B fit on Geant4 simulations of SCONE
-
-    _ = plot_ab_fit(FILENAMES)
-
-    # unfolding and saving
-
-    g_mult, syst_err, stat_err = g_mult_unfolding(energies, g_mult_raw, stat_err=stat_err_raw, out_name="g_mult.csv")
+    os.makedirs('outputs', exist_ok=True)
+    os.makedirs('figs', exist_ok=True)
 
-    # plot gamma-rays multiplicity vs. incident energy
+    # stages: read SCONE (56us and 5.6us windows), read Geant4, A, B fit, merging
+    # @ 4 MeV (MERGE = "cut") or per bin, unfolding and figures; only the stages
+    # whose inputs, settings or code changed since the last run are computed
 
-    _ = plot_g_mult(energies[1:], g_mult[1:], syst_err[1:], stat_err[1:])
+    pipeline = Pipeline(analysis_steps(merg=3, out_name="g_mult.csv"), use_cache=not args.rerun)
 
-    # plot gamma-rays multiplicity vs. angular momentum
+    # figures are rendered beside the analysis (waited for at the end)
 
-    _ = plot_angmom(energies[1:], g_mult[1:], stat_err[1:])
+    with FigurePool() as figures:
+        pipeline.run(figures)
 
+    print(", ".join(f"{name}: {status}" for name, status in pipeline.status.items()))
@@ -0,0 +1,179 @@
+""" Merging of SCONE coincidence-window measurements """
+
+# librairies
+
+import warnings
+import numpy as np
+
+# functions
+
+
+def merge_cut(windows, merg):
+    """
+    Merge window measurements with a hard cut: bins before merg from the first
+    window, the others from the second one.
+
+    Args:
+        windows (list of narray): Two arrays of shape (..., energies).
+        merg (int): Merging index.
+
+    Returns:
+        (narray): Merged array.
+    """
+    return np.concatenate((windows[0][..., :merg], windows[1][..., merg:]), axis=-1)
+
+
+def merge_weights(errors, method="ivw", corr=0., merg=None):
+    """
+    Weights of each window per energy bin. The "ivw" and "best" methods
+    assume that every window measures the same raw quantity in each bin
+    (see merge_chi2 for the consistency of the windows).
+
+    Args:
+        errors (narray): 1-sigma errors, shape (windows, energies).
+        method (str): "ivw" (best linear unbiased estimate, inverse-variance
+            weights for uncorrelated windows), "best" (smallest error per bin)
+            or "cut" (first window before merg, second one after).
+        corr (float or narray): Correlation between windows, scalar or (windows, windows).
+            Defaults to 0 (independent windows).
+        merg (int or None): Merging index of the "cut" method.
+
+    Returns:
+        (narray): Weights, shape (windows, energies), summing to 1 per bin.
+    """
+    errors = np.asarray(errors, dtype=float)
+    k, n = errors.shape
+    usable = np.isfinite(errors) & (errors > 0)
+
+    if method == "cut":
+        if k != 2 or merg is None:
+            raise ValueError("The cut method needs two windows and a merging index")
+        weights = np.zeros((k, n))
+        weights[0, :merg], weights[1, merg:] = 1., 1.
+        return weights
+
+    if method == "best":
+        best = np.argmin(np.where(usable, errors, np.inf), axis=0)
+        return (np.arange(k)[:, None] == best).astype(float)
+
+    if method == "ivw":
+
+        # per-bin covariance between windows (unusable windows decoupled)
+
+        corr = np.broadcast_to(np.where(np.eye(k, dtype=bool), 1., corr), (k, k))
+        sigma = np.where(usable, errors, 1.).T
+        cov = sigma[:, :, None] * corr * sigma[:, None, :]
+        cov = np.where(usable.T[:, :, None] & usable.T[:, None, :], cov, np.eye(k))
+
+        # BLUE: w = C^-1 1 / (1' C^-1 1)
+
+        cinv_one = np.linalg.solve(cov, np.ones((n, k, 1)))[..., 0] * usable.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = cinv_one / cinv_one.sum(axis=1, keepdims=True)
+        return np.nan_to_num(weights).T
+
+    raise ValueError(f"Unknown merging method: {method}")
+
+
+def merge_values(values, weights):
+    """
+    Merge window measurements with given weights (windows with zero weight
+    ignored, even if NaN), for any number of replica axes.
+
+    Args:
+        values (narray): Measurements, shape (windows, ..., energies).
+        weights (narray): Weights, shape (windows, energies).
+
+    Returns:
+        (narray): Merged measurements, shape (..., energies), NaN where all weights are 0.
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    weights = weights.reshape(weights.shape[:1] + (1,) * (values.ndim - 2) + weights.shape[1:])
+    merged = np.sum(np.where(weights != 0, weights * values, 0.), axis=0)
+    return np.where(weights.sum(axis=0) == 0, np.nan, merged)
+
+
+def merge_chi2(values, errors, corr=0.):
+    """
+    Consistency of the windows in each energy bin: chi2 of the measurements
+    around their best linear unbiased estimate, r' C^-1 r.
+
+    Args:
+        values (narray): Measurements, shape (windows, energies).
+        errors (narray): 1-sigma errors, shape (windows, energies).
+        corr (float or narray): Correlation between windows. Defaults to 0.
+
+    Returns:
+        (narray): Chi2 per bin, shape (energies,).
+        (narray): Degrees of freedom per bin (usable windows - 1), shape (energies,).
+    """
+    values = np.asarray(values, dtype=float)
+    errors = np.asarray(errors, dtype=float)
+    k, n = errors.shape
+    usable = np.isfinite(errors) & (errors > 0) & np.isfinite(values)
+
+    # residuals to the BLUE (unusable windows decoupled)
+
+    mean = merge_values(values, merge_weights(np.where(usable, errors, np.nan), method="ivw", corr=corr))
+    res = np.where(usable, values - mean, 0.).T
+
+    corr = np.broadcast_to(np.where(np.eye(k, dtype=bool), 1., corr), (k, k))
+    sigma = np.where(usable, errors, 1.).T
+    cov = sigma[:, :, None] * corr * sigma[:, None, :]
+    cov = np.where(usable.T[:, :, None] & usable.T[:, None, :], cov, np.eye(k))
+
+    chi2 = np.einsum('ei,ei->e', res, np.linalg.solve(cov, res[..., None])[..., 0])
+    return chi2, np.clip(usable.sum(axis=0) - 1, 0, None)
+
+
+def merge_windows(values, errors, method="ivw", corr=0., merg=None, max_birge=3.):
+    """
+    Combine measurements of the same target in several coincidence windows,
+    per energy bin and vectorized over windows and energies. The "ivw" and
+    "best" methods assume that the windows measure the same raw quantity:
+    where they disagree (chi2/ndf > 1), the merged variance is scaled up by
+    chi2/ndf (Birge ratio squared), with a warning beyond max_birge.
+
+    Args:
+        values (narray): Measurements, shape (windows, energies).
+        errors (narray): 1-sigma errors, shape (windows, energies).
+        method (str): "ivw", "best" or "cut" (see merge_weights). Defaults to "ivw".
+        corr (float or narray): Correlation between windows. Defaults to 0.
+        merg (int or None): Merging index of the "cut" method.
+        max_birge (float): Birge ratio sqrt(chi2/ndf) above which a warning is issued. Defaults to 3.
+
+    Returns:
+        (narray): Merged measurements, shape (energies,).
+        (narray): Covariance matrix of merged measurements, shape (energies, energies).
+        (narray): Weights, shape (windows, energies).
+        (narray): Chi2 per degree of freedom of the windows per bin (NaN for a single window).
+    """
+    values = np.asarray(values, dtype=float)
+    errors = np.asarray(errors, dtype=float)
+    k = values.shape[0]
+    weights = merge_weights(errors, method=method, corr=corr, merg=merg)
+
+    # merged values
+
+    merged = merge_values(values, weights)
+
+    # merged variance: w' C w per bin (bins are independent)
+
+    corr = np.broadcast_to(np.where(np.eye(k, dtype=bool), 1., corr), (k, k))
+    werr = np.where(weights != 0, weights * errors, 0.)
+    var = np.einsum('ie,ij,je->e', werr, corr, werr)
+
+    # consistency of the windows (scaled variance for the combining methods)
+
+    chi2, ndf = merge_chi2(values, errors, corr)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2_ndf = np.where(ndf > 0, chi2 / ndf, np.nan)
+    if method in ("ivw", "best"):
+        var = var * np.where(chi2_ndf > 1., chi2_ndf, 1.)
+        bad = np.flatnonzero(chi2_ndf > max_birge**2)
+        if bad.size:
+            warnings.warn(f"Inconsistent windows in energy bins {bad.tolist()} "
+                          f"(chi2/ndf up to {np.nanmax(chi2_ndf):.3g}), merged errors scaled up")
+
+    return merged, np.diag(var), weights, chi2_ndf
@@ -0,0 +1,227 @@
+""" Registry of SCONE response models to fission gamma-rays """
+
+# librairies
+
+import numpy as np
+
+# class
+
+
+class ResponseModel:
+    """
+    Response model of SCONE to a fission cascade: detected multiplicity
+    y = forward(x, *params) for an emitted multiplicity x. Each model supplies
+    its forward function, its analytic inverse and its partial derivatives;
+    the derivatives of the inverse follow from the implicit function theorem.
+    All functions broadcast their arguments together.
+
+    Args:
+        name (str): Name of the model in MODELS.
+        param_names (tuple of str): Names of the parameters.
+        p0 (list of float): Initial trial of the fits.
+        forward (callable): y = forward(x, *params).
+        inverse (callable): x = inverse(y, *params).
+        dforward (callable): (dy/dx, [dy/dp for p in params]) = dforward(x, *params).
+        lower (list of float or None): Lower bounds of the parameters. Defaults to 0.
+        upper (list of float or None): Upper bounds of the parameters. Defaults to +inf.
+    """
+
+    def __init__(self, name, param_names, p0, forward, inverse, dforward, lower=None, upper=None):
+        self.name = name
+        self.param_names = tuple(param_names)
+        self.p0 = np.asarray(p0, dtype=float)
+        self.forward = forward
+        self.inverse = inverse
+        self.dforward = dforward
+        self.lower = np.zeros(len(p0)) if lower is None else np.asarray(lower, dtype=float)
+        self.upper = np.full(len(p0), np.inf) if upper is None else np.asarray(upper, dtype=float)
+
+    @property
+    def n_params(self):
+        return len(self.param_names)
+
+    def jac(self, x, *params):
+        """
+        Jacobian of the forward function with respect to the parameters.
+
+        Returns:
+            (narray): dy/dp, shape (..., n_params).
+        """
+        _, dp = self.dforward(x, *params)
+        return np.stack(np.broadcast_arrays(*dp), axis=-1)
+
+    def inverse_jac(self, y, *params):
+        """
+        Derivatives of the inverse function.
+
+        Returns:
+            (narray): dx/dy.
+            (narray): dx/dp, shape (..., n_params).
+        """
+        x = self.inverse(y, *params)
+        dx, dp = self.dforward(x, *params)
+        dx_dy = 1. / dx
+        return dx_dy, - np.stack(np.broadcast_arrays(*dp), axis=-1) * dx_dy[..., None]
+
+
+MODELS = {}
+
+
+def register_model(model):
+    """
+    Add a response model to the registry (replacing a model of the same name).
+
+    Args:
+        model (ResponseModel): Response model.
+
+    Returns:
+        (ResponseModel): The model.
+    """
+    MODELS[model.name] = model
+    return model
+
+
+# saturating exponential: a*(1 - exp(-x/b))
+
+
+def _exp_dforward(x, a, b):
+    e = np.exp(-x / b)
+    return a * e / b, [1. - e, - a * x * e / b**2]
+
+
+register_model(ResponseModel(
+    "exp", ("a", "b"), [20., 30.],
+    forward=lambda x, a, b: a * (1. - np.exp(-x / b)),
+    inverse=lambda y, a, b: - b * np.log(1. - y / a),
+    dforward=_exp_dforward,
+))
+
+
+# saturating exponential plus a linear term: a*(1 - exp(-x/b)) + k*x
+# inverse: x = (y - a)/k + b*W(a/(b k) exp(-(y - a)/(b k))), W(exp(s)) = wrightomega(s)
+
+
+def _exp_lin_inverse(y, a, b, k):
+    from scipy.special import wrightomega
+    y, a, b, k = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (y, a, b, k)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.log(a / (b * k)) - (y - a) / (b * k)
+        x = (y - a) / k + b * np.real(wrightomega(s))
+        return np.where(k > 0, x, - b * np.log(1. - y / a))
+
+
+def _exp_lin_dforward(x, a, b, k):
+    e = np.exp(-x / b)
+    return a * e / b + k, [1. - e, - a * x * e / b**2, x * np.ones_like(e)]
+
+
+register_model(ResponseModel(
+    "exp_lin", ("a", "b", "k"), [20., 30., 0.01],
+    forward=lambda x, a, b, k: a * (1. - np.exp(-x / b)) + k * x,
+    inverse=_exp_lin_inverse,
+    dforward=_exp_lin_dforward,
+))
+
+
+# saturating exponential with pile-up: a*(1 - (1 - q)*exp(-x/b)), i.e. a fraction q
+# of the a assemblies fired by random coincidences (pile-up, noise) whatever the
+# cascade, so that the response starts at a*q instead of 0 and saturates at a
+
+
+def _exp_pileup_dforward(x, a, b, q):
+    e = np.exp(-x / b)
+    return a * (1. - q) * e / b, [1. - (1. - q) * e, - a * (1. - q) * x * e / b**2, a * e]
+
+
+register_model(ResponseModel(
+    "exp_pileup", ("a", "b", "q"), [20., 30., 0.01],
+    forward=lambda x, a, b, q: a * (1. - (1. - q) * np.exp(-x / b)),
+    inverse=lambda y, a, b, q: - b * np.log((1. - y / a) / (1. - q)),
+    dforward=_exp_pileup_dforward,
+    upper=[np.inf, np.inf, 1.],
+))
+
+
+# functions
+
+
+def fit_model_batched(model, x, y, mask, n_iter=200, tol=1e-10):
+    """
+    Least-squares fits of a response model to several curves at once
+    (Levenberg-Marquardt batched over curves, analytic Jacobian).
+
+    Args:
+        model (ResponseModel): Response model.
+        x (narray): Emitted multiplicities, shape (curves, points), padded.
+        y (narray): Detected multiplicities, shape (curves, points), padded.
+        mask (narray): Valid points, shape (curves, points).
+        n_iter (int): Maximum number of iterations. Defaults to 200.
+        tol (float): Relative step for convergence. Defaults to 1e-10.
+
+    Returns:
+        popt (narray): Fitted parameters, shape (curves, n_params).
+        pcov (narray): Covariances, shape (curves, n_params, n_params), scaled by the residual variance.
+        rss (narray): Residual sums of squares, shape (curves,).
+    """
+    n_curves, k = x.shape[0], model.n_params
+    p = np.tile(model.p0, (n_curves, 1))
+    lam = np.full(n_curves, 1e-3)
+
+    def residuals(p):
+        with np.errstate(all='ignore'):
+            r = np.where(mask, model.forward(x, *p.T[..., None]) - y, 0.)
+        cost = (r**2).sum(axis=1)
+        return r, np.where(np.isfinite(cost), cost, np.inf)
+
+    r, cost = residuals(p)
+    for _ in range(n_iter):
+        with np.errstate(all='ignore'):
+            J = np.where(mask[..., None], model.jac(x, *p.T[..., None]), 0.)
+        g = np.einsum('fnk,fn->fk', J, r)
+
+        # parameters held at a bound they are pushed against are frozen
+
+        free = ~(((p <= model.lower) & (g > 0)) | ((p >= model.upper) & (g < 0)))
+        J, g = J * free[:, None, :], g * free
+        H = np.einsum('fnk,fnl->fkl', J, J) + np.eye(k) * ~free[:, None, :]
+        damp = lam[:, None, None] * (np.diagonal(H, axis1=1, axis2=2)[:, None, :] * np.eye(k) + 1e-12 * np.eye(k))
+        step = - np.linalg.solve(H + damp, g[..., None])[..., 0]
+        p_new = np.clip(p + step, model.lower, model.upper)
+        r_new, cost_new = residuals(p_new)
+        accept = cost_new < cost
+        p = np.where(accept[:, None], p_new, p)
+        r = np.where(accept[:, None], r_new, r)
+        cost = np.where(accept, cost_new, cost)
+        lam = np.where(accept, lam / 3., lam * 4.)
+        small = (np.abs(step) <= tol * (np.abs(p) + tol)).all(axis=1)
+        if np.all((accept & small) | (lam > 1e10)):
+            break
+
+    # covariance as in curve_fit: s^2 (J'J)^-1
+
+    with np.errstate(all='ignore'):
+        J = np.where(mask[..., None], model.jac(x, *p.T[..., None]), 0.)
+    H = np.einsum('fnk,fnl->fkl', J, J)
+    dof = np.maximum(mask.sum(axis=1) - k, 1)
+    pcov = np.linalg.pinv(H) * (cost / dof)[:, None, None]
+
+    return p, pcov, cost
+
+
+def information_criteria(rss, n_points, n_params):
+    """
+    Akaike and Bayesian information criteria of least-squares fits (Gaussian errors).
+
+    Args:
+        rss (narray): Residual sums of squares.
+        n_points (narray): Number of fitted points.
+        n_params (int): Number of parameters.
+
+    Returns:
+        (narray): AIC.
+        (narray): BIC.
+    """
+    n_points = np.asarray(n_points, dtype=float)
+    with np.errstate(divide='ignore'):
+        log_l = n_points * np.log(rss / n_points)
+    return log_l + 2 * n_params, log_l + n_params * np.log(n_points)
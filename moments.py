@@ -0,0 +1,158 @@
+""" Statistical moments of multiplicity distributions """
+
+# librairies
+
+import numpy as np
+from math import comb
+
+# functions
+
+
+def issparse(x):
+    """
+    Whether x is a scipy.sparse matrix or array (without importing scipy.sparse).
+    """
+    return type(x).__module__.startswith("scipy.sparse")
+
+
+def power_sums(counts, values, order):
+    """
+    Power sums S_k = sum_m m^k n_m of each column, in one pass over the counts.
+
+    Args:
+        counts (narray or sparse array): Counts, shape (..., multiplicities, energies)
+            (2-D only if sparse).
+        values (narray): Multiplicity axis.
+        order (int): Highest power.
+
+    Returns:
+        (narray): Power sums, shape (order+1, ..., energies).
+    """
+    powers = np.vander(np.asarray(values, dtype=float), order + 1, increasing=True)
+    if issparse(counts):
+        return np.asarray(counts.T @ powers).T
+    return np.moveaxis(np.matmul(powers.T, np.asarray(counts, dtype=float)), -2, 0)
+
+
+def central_from_raw(raw):
+    """
+    Central moments from raw moments.
+
+    Args:
+        raw (narray): Raw moments mu'_1 ... mu'_K along axis 0.
+
+    Returns:
+        (narray): Central moments mu_1 (= 0) ... mu_K along axis 0.
+    """
+    raw0 = np.concatenate([np.ones_like(raw[:1]), raw])
+    return np.stack([
+        sum(comb(k, j) * raw0[j] * (-raw0[1])**(k - j) for j in range(k + 1))
+        for k in range(1, len(raw) + 1)
+    ])
+
+
+def factorial_from_raw(raw):
+    """
+    Factorial moments E[m(m-1)...(m-k+1)] from raw moments (Stirling numbers of the first kind).
+
+    Args:
+        raw (narray): Raw moments mu'_1 ... mu'_K along axis 0.
+
+    Returns:
+        (narray): Factorial moments of orders 1 ... K along axis 0.
+    """
+    order = len(raw)
+    stirling = np.zeros((order + 1, order + 1))
+    stirling[0, 0] = 1.
+    for k in range(1, order + 1):
+        stirling[k, 1:] = stirling[k - 1, :-1] - (k - 1) * stirling[k - 1, 1:]
+    return np.stack([sum(stirling[k, j] * raw[j - 1] for j in range(1, k + 1)) for k in range(1, order + 1)])
+
+
+def cumulants_from_raw(raw):
+    """
+    Cumulants from raw moments.
+
+    Args:
+        raw (narray): Raw moments mu'_1 ... mu'_K along axis 0.
+
+    Returns:
+        (narray): Cumulants kappa_1 ... kappa_K along axis 0.
+    """
+    kappa = []
+    for n in range(1, len(raw) + 1):
+        kappa.append(raw[n - 1] - sum(comb(n - 1, m - 1) * kappa[m - 1] * raw[n - m - 1] for m in range(1, n)))
+    return np.stack(kappa)
+
+
+def shape_from_raw(raw):
+    """
+    Standard deviation, skewness and excess kurtosis from raw moments (order >= 4).
+
+    Args:
+        raw (narray): Raw moments mu'_1 ... mu'_K along axis 0.
+
+    Returns:
+        (narray): (std, skewness, kurtosis) along axis 0.
+    """
+    mu = central_from_raw(raw[:4])
+    return np.stack([np.sqrt(mu[1]), mu[2] / mu[1]**1.5, mu[3] / mu[1]**2 - 3.])
+
+
+MOMENT_KINDS = {
+    "raw": lambda raw: raw,
+    "central": central_from_raw,
+    "factorial": factorial_from_raw,
+    "cumulant": cumulants_from_raw,
+    "shape": shape_from_raw,
+}
+
+
+def count_moments(counts, values, order=4, kinds=("raw", "central", "factorial", "cumulant")):
+    """
+    Moments of the distribution of each energy column and their statistical
+    covariances. Raw moments come from one pass of power sums up to 2*order,
+    their covariance is (mu'_{i+j} - mu'_i mu'_j)/N, and derived moments are
+    propagated with a complex-step Jacobian (exact for these polynomials).
+
+    Args:
+        counts (narray): Counts, shape (..., multiplicities, energies).
+        values (narray): Multiplicity axis.
+        order (int): Highest moment order. Defaults to 4.
+        kinds (tuple of str): Moments to compute among MOMENT_KINDS.
+
+    Returns:
+        (dict): For each kind, (moments, cov): moments of shape (orders, ..., energies)
+            and covariance of shape (..., energies, orders, orders).
+    """
+
+    # raw moments up to 2*order
+
+    sums = power_sums(counts, values, 2 * order)
+    n = sums[0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raw = sums[1:] / n
+
+    # covariance of raw moments of orders 1 ... order
+
+    i = np.arange(1, order + 1)
+    raw0 = np.concatenate([np.ones_like(raw[:1]), raw])
+    raw_cov = (raw0[i[:, None] + i[None, :]] - raw0[i[:, None]] * raw0[i[None, :]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raw_cov = np.moveaxis(raw_cov / n, (0, 1), (-2, -1))
+
+    # derived moments and complex-step Jacobians
+
+    raw = raw[:order]
+    h = 1e-20
+    step = 1j * h * np.eye(order).reshape((order,) + (1,) * (raw.ndim - 1) + (order,))
+    results = {}
+    for kind in kinds:
+        f = MOMENT_KINDS[kind]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            moments = np.real(f(raw))
+            jac = np.moveaxis(np.imag(f(raw[..., None] + step)) / h, 0, -2)
+            cov = jac @ raw_cov @ np.swapaxes(jac, -1, -2)
+        results[kind] = (moments, cov)
+
+    return results
@@ -0,0 +1,178 @@
+""" Online unfolding of a growing SCONE list-mode file """
+
+
+# librairies
+
+
+import io
+import os
+import time
+import argparse
+from pathlib import Path
+import pandas as pd
+from env import *
+from unfolding import g_mult_unfolding
+from listmode import LISTMODE_DTYPE, ENERGY_EDGES, N_MULT, accumulate_counts
+
+
+# class
+
+
+class OnlineUnfolding:
+    """
+    Running count matrix and unfolded multiplicities of a list-mode file still
+    being written. Each update reads only the records appended since the last
+    one and recomputes the moments and the unfolding of the touched energy
+    bins only, so that its cost does not depend on the data already accumulated.
+
+    Args:
+        filepath (str or Path): Path to the growing list-mode file.
+        binary (bool or None): Binary records or text. Defaults to None (binary for ".bin").
+        energy_edges (narray): Incident energy bin edges [MeV]. Defaults to 1 MeV bins.
+        n_mult (int): Number of multiplicity bins. Defaults to 31.
+    """
+
+    def __init__(self, filepath, binary=None, energy_edges=ENERGY_EDGES, n_mult=N_MULT):
+        self.filepath = Path(filepath)
+        self.binary = self.filepath.suffix == ".bin" if binary is None else binary
+        self.energy_edges = energy_edges
+        self.offset = 0 # bytes already read
+
+        # running counts of all energy bins
+
+        n_e = len(energy_edges) - 1
+        self.counts = np.zeros((n_mult, n_e), dtype=np.int64)
+        self.mult = np.arange(n_mult, dtype=float)
+
+        # published quantities (ENERGY_BINS)
+
+        self.energies = (0.5 * (energy_edges[1:] + energy_edges[:-1]))[ENERGY_BINS]
+        n = self.energies.size
+        self.g_mult_raw, self.stat_err_raw = np.full(n, np.nan), np.full(n, np.nan)
+        self.g_mult, self.syst_err, self.stat_err = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+
+    def read_new(self):
+        """
+        Read the complete records appended since the last call.
+
+        Returns:
+            (narray): Incident energies of the new records.
+            (narray): Multiplicities of the new records.
+        """
+        if not self.filepath.exists():
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        size = self.filepath.stat().st_size
+
+        with open(self.filepath, 'rb') as f:
+            f.seek(self.offset)
+            if self.binary:
+                n = (size - self.offset) // LISTMODE_DTYPE.itemsize
+                records = np.fromfile(f, dtype=LISTMODE_DTYPE, count=n)
+                self.offset += n * LISTMODE_DTYPE.itemsize
+                return records['energy'], records['mult']
+            raw = f.read(size - self.offset)
+
+        # text: complete lines only
+
+        end = raw.rfind(b"\n") + 1
+        self.offset += end
+        lines = [l for l in raw[:end].splitlines() if l.strip() and not l.lstrip().startswith(b"#")]
+        if len(lines) == 0:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        data = pd.read_csv(io.BytesIO(b"\n".join(lines)), sep=r"\s+", header=None, comment="#").to_numpy()
+        return data[:, 0], data[:, 1].astype(np.int64)
+
+    def update(self):
+        """
+        Add the new records and refresh the touched energy bins.
+
+        Returns:
+            (narray): Indices (in self.energies) of the refreshed bins.
+        """
+        energy, mult = self.read_new()
+        if energy.size == 0:
+            return np.zeros(0, dtype=int)
+        touched = accumulate_counts(self.counts, energy, mult, self.energy_edges)
+
+        # touched bins among the published ones
+
+        start = ENERGY_BINS.start
+        touched = touched[(touched >= start) & (touched < start + self.energies.size)]
+        if touched.size == 0:
+            return touched
+        cols = self.counts[:, touched]
+        idx = touched - start
+
+        # moments of touched bins
+
+        n, s1, s2 = power_sums(cols, self.mult, 2)
+        mean = s1 / n
+        var = np.clip(s2 / n - mean**2, 0., None)
+        self.g_mult_raw[idx] = mean
+        self.stat_err_raw[idx] = np.sqrt(var / n)
+
+        # unfolding of touched bins
+
+        nubar = (ENV.nubar_jeff[idx], ENV.nubar_jeff_err[idx])
+        self.g_mult[idx], self.syst_err[idx], self.stat_err[idx] = g_mult_unfolding(
+            self.energies[idx], self.g_mult_raw[idx], stat_err=self.stat_err_raw[idx], nubar=nubar
+        )
+
+        return idx
+
+    def publish(self, out_name=None, callback=None):
+        """
+        Publish the current unfolded multiplicities.
+
+        Args:
+            out_name (str or None): Name of the output CSV file in outputs/. Defaults to None.
+            callback (callable or None): Called with (energies, g_mult, syst_err, stat_err). Defaults to None.
+        """
+        if out_name is not None:
+            data = np.column_stack([self.energies, self.g_mult, self.syst_err, self.stat_err])
+            np.savetxt(OUT_DIR/out_name, data, fmt="%.3g %.3g %.3g %.3g",
+                       header="energy g_mult g_mult_err stat_err", comments="")
+        if callback is not None:
+            callback(self.energies, self.g_mult, self.syst_err, self.stat_err)
+
+    def run(self, cadence=10., poll=1., out_name=None, callback=None, max_idle=None):
+        """
+        Follow the file: update every poll seconds, publish every cadence seconds.
+
+        Args:
+            cadence (float): Publication period [s]. Defaults to 10.
+            poll (float): Polling period of the file [s]. Defaults to 1.
+            out_name (str or None): Name of the output CSV file in outputs/. Defaults to None.
+            callback (callable or None): See publish. Defaults to None.
+            max_idle (float or None): Stop after this time without new records [s]. Defaults to None (never).
+        """
+        last_publish, last_data, changed = time.monotonic(), time.monotonic(), False
+        while True:
+            if self.update().size:
+                last_data, changed = time.monotonic(), True
+            now = time.monotonic()
+            if changed and now - last_publish >= cadence:
+                self.publish(out_name, callback)
+                last_publish, changed = now, False
+            if max_idle is not None and now - last_data >= max_idle:
+                if changed:
+                    self.publish(out_name, callback)
+                return
+            time.sleep(poll)
+
+
+# run
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="GASCONE online unfolding")
+    parser.add_argument("listmode", help="growing list-mode file")
+    parser.add_argument("--cadence", type=float, default=10., help="publication period [s]")
+    parser.add_argument("--poll", type=float, default=1., help="polling period [s]")
+    parser.add_argument("-o", "--output", default="g_mult_online.csv", help="output CSV in outputs/")
+    parser.add_argument("--max-idle", type=float, default=None, help="stop after this idle time [s]")
+    args = parser.parse_args()
+
+    os.makedirs(OUT_DIR, exist_ok=True)
+    OnlineUnfolding(args.listmode).run(args.cadence, args.poll, args.output, max_idle=args.max_idle)
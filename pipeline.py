@@ -0,0 +1,164 @@
+""" Stages of the main analysis, as an incremental pipeline (see dag.py) """
+
+
+# librairies
+
+
+from env import *
+from dag import Step
+from response import ResponseDataset, response_curves, fit_response_curves
+from unfolding import g_mult_unfolding
+from merging import merge_windows
+from plots import plot_g_mult, plot_angmom, plot_ab_fit
+from contamination import NEUTRON_SPECTRA_FILE
+
+
+# settings of env.py read by the unfolding, tracked by value so that editing
+# another setting of env.py (e.g. FONT_SIZE) does not invalidate it; the code of
+# env.py it runs (LazyEnv) is tracked by its source
+
+UNFOLDING_ENV = (
+    "FILENAMES", "C", "DC", "PILEUP", "DPILEUP", "GLOBAL_FIT",
+    "ENERGY_RESPONSE", "RESPONSE_TARGET", "RESPONSE_GENERATOR", "RESPONSE_FILES", "TABLE_ENERGIES",
+    "ENERGY_CONTAMINATION", "NEUTRON_EFFICIENCY", "C_ENERGY", "RESPONSE_MODEL",
+)
+
+NUBAR_FILE = EVAL_DIR/"238U_nubar_JEFF4.csv"
+REFERENCE_FILES = [
+    LIT_DIR/"Qi_200keV_data.csv", LIT_DIR/"Laborie_190keV_data.csv",
+    SIMU_DIR/"238U_CGMF_200keV.csv", SIMU_DIR/"238U_GEF_200keV.csv",
+]
+
+
+# stages
+
+
+def read_scone_step(files):
+    """
+    Raw gamma-rays multiplicities of SCONE in each coincidence window.
+    """
+    meas = [scone_meas(filename=fname) for fname in files]
+    return {
+        "energies": meas[0][0],
+        "g_mult_raw": np.array([m[1] for m in meas]),
+        "stat_err": np.array([m[2] for m in meas]),
+    }
+
+
+def read_geant4_step(filenames):
+    """
+    Geant4 response curves of SCONE, concatenated with the size of each curve.
+    """
+    curves = response_curves(filenames)
+    return {
+        "emitted": np.concatenate([x for x, _ in curves]),
+        "detected": np.concatenate([y for _, y in curves]),
+        "sizes": np.array([len(x) for x, _ in curves]),
+    }
+
+
+def fit_response_step(geant4):
+    """
+    Global fit of the response model constants on the Geant4 response curves.
+    """
+    popt, pcov = fit_response_curves(split_curves(geant4))
+    return {"popt": popt, "pcov": pcov}
+
+
+def merge_step(scone, method, merg):
+    """
+    Merged multiplicities of the coincidence windows and their statistical errors.
+    """
+    g_mult_raw, merged_cov, _, _ = merge_windows(scone["g_mult_raw"], scone["stat_err"], method=method, merg=merg)
+    return {"g_mult_raw": g_mult_raw, "merged_cov": merged_cov, "stat_err": np.sqrt(np.diag(merged_cov))}
+
+
+def unfold_step(scone, merged, geant4, fit, filenames, out_name):
+    """
+    Unfolded multiplicities (saved in outputs/), with the fitted response
+    primed in the lazy environment instead of being read and fitted again.
+    """
+    ENV.prime(response=response_dataset(geant4, fit, filenames))
+    g_mult, syst_err, stat_err = g_mult_unfolding(
+        scone["energies"], merged["g_mult_raw"], stat_err=merged["stat_err"], out_name=out_name
+    )
+    return {"g_mult": g_mult, "syst_err": syst_err, "stat_err": stat_err}
+
+
+def plot_ab_fit_step(geant4, fit, filenames):
+    return plot_ab_fit(response_dataset(geant4, fit, filenames))
+
+
+def plot_g_mult_step(scone, unfolded):
+    u = unfolded
+    return plot_g_mult(scone["energies"][1:], u["g_mult"][1:], u["syst_err"][1:], u["stat_err"][1:])
+
+
+def plot_angmom_step(scone, unfolded):
+    return plot_angmom(scone["energies"][1:], unfolded["g_mult"][1:], unfolded["stat_err"][1:])
+
+
+# functions
+
+
+def split_curves(geant4):
+    """
+    Response curves (emitted_mult, detected_mult) of each file from the read_geant4 outputs.
+    """
+    bounds = np.cumsum(geant4["sizes"])[:-1]
+    return list(zip(np.split(geant4["emitted"], bounds), np.split(geant4["detected"], bounds)))
+
+
+def response_dataset(geant4, fit, filenames):
+    """
+    ResponseDataset of the read_geant4 and fit_response outputs.
+    """
+    return ResponseDataset.from_fit(filenames, fit["popt"], fit["pcov"], split_curves(geant4))
+
+
+def analysis_steps(scone_files=("238U_meas_mg_56us.csv", "238U_meas_mg_5us6.csv"), merg=3, out_name="g_mult.csv"):
+    """
+    Stages of main.py: read SCONE, read Geant4, fit response, merge windows,
+    unfold, and the three figures.
+
+    Args:
+        scone_files (tuple of str): SCONE files, one per coincidence window.
+        merg (int): Merging index of the "cut" method. Defaults to 3.
+        out_name (str): Name of the output CSV file of the unfolding. Defaults to "g_mult.csv".
+
+    Returns:
+        (list of Step): Stages.
+    """
+    filenames = list(FILENAMES)
+    geant4_files = [GEANT4_DIR/f for f in filenames]
+    unfolding_files = [NUBAR_FILE]
+    if ENERGY_RESPONSE:
+        unfolding_files += [GEANT4_DIR/f for f in RESPONSE_FILES]
+    if ENERGY_CONTAMINATION:
+        unfolding_files.append(NEUTRON_SPECTRA_FILE)
+    unfolding_code = ("env.LazyEnv", "unfolding", "response", "models", "globalfit", "contamination", "pipeline")
+    plot_code = ("plots", "render", "angmom", "response", "models", "pipeline")
+
+    return [
+        Step("read_scone", read_scone_step, params={"files": list(scone_files)},
+             files=[SCONE_DIR/f for f in scone_files], code=("utils", "moments", "pipeline")),
+        Step("read_geant4", read_geant4_step, params={"filenames": filenames},
+             files=geant4_files, code=("utils", "response", "pipeline")),
+        Step("fit_response", fit_response_step, deps=("read_geant4",), env=("RESPONSE_MODEL",),
+             code=("response", "models", "pipeline")),
+        Step("merge", merge_step, deps=("read_scone",), params={"method": MERGE, "merg": merg},
+             code=("merging", "pipeline")),
+        Step("unfold", unfold_step, deps=("read_scone", "merge", "read_geant4", "fit_response"),
+             params={"filenames": filenames, "out_name": out_name}, files=unfolding_files,
+             env=UNFOLDING_ENV, code=unfolding_code,
+             products=[OUT_DIR/out_name, (OUT_DIR/out_name).with_suffix(".cov.npz")]),
+        Step("plot_ab_fit", plot_ab_fit_step, deps=("read_geant4", "fit_response"),
+             params={"filenames": filenames}, env=("FONT_SIZE", "RESPONSE_MODEL"), code=plot_code,
+             products=[FIG_DIR/"AB_fit.pdf"], render=True),
+        Step("plot_g_mult", plot_g_mult_step, deps=("read_scone", "unfold"),
+             files=REFERENCE_FILES, env=("FONT_SIZE",), code=plot_code,
+             products=[FIG_DIR/"g_mult.pdf"], render=True),
+        Step("plot_angmom", plot_angmom_step, deps=("read_scone", "unfold"), files=[NUBAR_FILE],
+             env=("FONT_SIZE", "SN", "SNU_MIN", "SNU_MAX", "FRAG_MOM_MICRO"), code=plot_code,
+             products=[FIG_DIR/"angmom.pdf"], render=True),
+    ]
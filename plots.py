@@ -4,23 +4,15 @@
 
 from env import *
 import matplotlib as mpl
-import matplotlib.pyplot as plt
 from angmom import angmom_capture, g_mult_electrans
-from response import fission_gcasc_resp, g_mult_scone, fit_scone_gconst_multiple
-
-# plots design
-
-plt.rcParams.update({'font.size': FONT_SIZE, 'font.family': 'times new roman'})
-mpl.rcParams['mathtext.fontset']='stix'
-mpl.rcParams['font.family']='STIXGeneral'
-mpl.rcParams['axes.linewidth'] = 2
-plt.rcParams['pdf.fonttype'] = 42     # Texte en polices TrueType (pas converti en chemins)
-plt.rcParams['ps.fonttype'] = 42
-plt.rcParams['lines.linewidth'] = 1.0 # Réduit l'épaisseur par défaut des courbes
-plt.rcParams['axes.linewidth'] = 1.0  # Bordures d'axes plus fines
+from models import MODELS
+from response import ResponseDataset
+from render import styled_figure
+from profiling import profiled
 
 # plot gamma-rays multiplicity
 
+@profiled()
 def plot_g_mult(energies, g_mult, syst_err, stat_err):
     """
     Plotting gamma-rays multiplicity vs. incident energy.
@@ -35,72 +27,68 @@ def plot_g_mult(energies, g_mult, syst_err, stat_err):
         (str): Plot file direction.
     """
 
-    # figure design
-
-    fig, ax = plt.subplots(1, 1, figsize=(10, 10))
-    fig.tight_layout()
-    ax.xaxis.set_tick_params(which='major', size=10, width=2, direction='in', top='on')
-    ax.xaxis.set_tick_params(which='minor', size=7, width=2, direction='in', top='on')
-    ax.yaxis.set_tick_params(which='major', size=10, width=2, direction='in', right='on')
-    ax.yaxis.set_tick_params(which='minor', size=7, width=2, direction='in', right='on')
-    plt.xticks(fontsize=FONT_SIZE)
-    plt.yticks(fontsize=FONT_SIZE)
-    plt.ylim(4.8,9.2)
-    ax.set_xticks([0, 10, 20, 30])
-    ax.set_yticks([5, 6, 7, 8, 9])
-    plt.xlabel(r'Incident neutron energy: $E_\mathrm{n}$ (MeV)',size=FONT_SIZE)
-    plt.ylabel(r'Average $\gamma$-rays multiplicity: $\bar{n}_\gamma$',size=FONT_SIZE)
-
-    # scone 
-
-    plt.errorbar(energies, g_mult, 
-                 xerr = [0.5 for i in energies], yerr=stat_err,
-                 fmt='.', color='red', linewidth=3, markersize=7, linestyle='none',
-                 label="SCONE (thres. 200 keV)"
-                 )
-    
-    plt.fill_between(energies, g_mult-syst_err, g_mult+syst_err,
-        color='red',alpha=0.15,
-        #label='Systematic uncertainty'
-    )
-
-    # literature
-
-    plt.errorbar(laborie_energies, laborie_mult, 
-                 xerr = laborie_energies_err, yerr=laborie_mult_err, 
-                 fmt='s', color='black', linewidth=3, markersize=7,
-                 label="Laborie (thres. 190 keV)"
-                 )
-    
-    plt.errorbar(qi_energies, qi_mult,
-                 yerr=qi_mult_err,
-                 fmt='o', color='green', linewidth=3, markersize=7,
-                 label="Qi (thres. 200 keV)"
-                 )
-    
-    # simulations
-
-    plt.plot(cgmf_energies, cgmf_mult,
-             linestyle='-', linewidth=3, color='blue',
-             label="CGMF (thres. 200 keV)"
-             )
-    
-    plt.plot(gef_energies, gef_mult,
-             linestyle='--', linewidth=3, color='saddlebrown',
-             label="GEF (thres. 200 keV)"
-             )
-    
-    # save
-    
-    plt.legend(loc = 'upper left',frameon=False, title_fontsize=FONT_SIZE)
-    dir = FIG_DIR/'g_mult.pdf'
-    plt.savefig(dir, format="pdf", bbox_inches='tight', dpi=300)
+    with styled_figure() as (fig, ax):
+
+        # figure design
+
+        ax.set_ylim(4.8,9.2)
+        ax.set_xticks([0, 10, 20, 30])
+        ax.set_yticks([5, 6, 7, 8, 9])
+        ax.set_xlabel(r'Incident neutron energy: $E_\mathrm{n}$ (MeV)',size=FONT_SIZE)
+        ax.set_ylabel(r'Average $\gamma$-rays multiplicity: $\bar{n}_\gamma$',size=FONT_SIZE)
+
+        # scone 
+
+        ax.errorbar(energies, g_mult, 
+                    xerr = [0.5 for i in energies], yerr=stat_err,
+                    fmt='.', color='red', linewidth=3, markersize=7, linestyle='none',
+                    label="SCONE (thres. 200 keV)"
+                    )
+        
+        ax.fill_between(energies, g_mult-syst_err, g_mult+syst_err,
+            color='red',alpha=0.15,
+            #label='Systematic uncertainty'
+        )
+
+        # literature
+
+        ax.errorbar(ENV.laborie_energies, ENV.laborie_mult, 
+                    xerr = ENV.laborie_energies_err, yerr=ENV.laborie_mult_err, 
+                    fmt='s', color='black', linewidth=3, markersize=7,
+                    label="Laborie (thres. 190 keV)"
+                    )
+        
+        ax.errorbar(ENV.qi_energies, ENV.qi_mult,
+                    yerr=ENV.qi_mult_err,
+                    fmt='o', color='green', linewidth=3, markersize=7,
+                    label="Qi (thres. 200 keV)"
+                    )
+        
+        # simulations
+
+        ax.plot(ENV.cgmf_energies, ENV.cgmf_mult,
+                linestyle='-', linewidth=3, color='blue',
+                label="CGMF (thres. 200 keV)"
+                )
+        
+        ax.plot(ENV.gef_energies, ENV.gef_mult,
+                linestyle='--', linewidth=3, color='saddlebrown',
+                label="GEF (thres. 200 keV)"
+                )
+        
+        # save
+        
+        ax.legend(loc = 'upper left',frameon=False, title_fontsize=FONT_SIZE)
+        dir = FIG_DIR/'g_mult.pdf'
+        fig.savefig(dir, format="pdf", bbox_inches='tight', dpi=300)
+
     return dir
 
 
 # plot angular momentum
 
 
+@profiled()
 def plot_angmom(energies, g_mult, g_mult_err):
     """
     Plotting gamma-rays multiplicity difference vs. angular momentum difference.
@@ -114,68 +102,63 @@ def plot_angmom(energies, g_mult, g_mult_err):
         (str): Plot file direction.
     """
 
-    # figure design
+    with styled_figure() as (fig, ax):
+
+        # figure design
+
+        ax.set_xlabel(r'$\Delta{}J_0$ ($\hbar$)',size=FONT_SIZE)
+        ax.set_ylabel(r'$\Delta{}\bar{n}_\gamma$',size=FONT_SIZE)
+        ax.set_ylim(-0.5,6.5)
+        ax.set_yticks([0,1,2,3,4,5,6])
 
-    fig, ax = plt.subplots(1, 1, figsize=(10, 10))
-    fig.tight_layout()
-    ax.xaxis.set_tick_params(which='major', size=10, width=2, direction='in', top='on')
-    ax.xaxis.set_tick_params(which='minor', size=7, width=2, direction='in', top='on')
-    ax.yaxis.set_tick_params(which='major', size=10, width=2, direction='in', right='on')
-    ax.yaxis.set_tick_params(which='minor', size=7, width=2, direction='in', right='on')
-    plt.xticks(fontsize=FONT_SIZE)
-    plt.yticks(fontsize=FONT_SIZE)
-    plt.xlabel(r'$\Delta{}J_0$ ($\hbar$)',size=FONT_SIZE)
-    plt.ylabel(r'$\Delta{}\bar{n}_\gamma$',size=FONT_SIZE)
-    ax.set_ylim(-0.5,6.5)
-    ax.set_yticks([0,1,2,3,4,5,6])
+        # SCONE
 
-    # SCONE
+        j0, j0_err = angmom_capture(energies)
+        dj0 = diff_init(j0)
+        dg_mult = diff_init(g_mult)
+        dg_mult_err = np.sqrt(np.array(g_mult_err)**2 + g_mult_err[0]**2)
 
-    j0, j0_err = angmom_capture(energies)
-    dj0 = diff_init(j0)
-    dg_mult = diff_init(g_mult)
-    dg_mult_err = np.sqrt(np.array(g_mult_err)**2 + g_mult_err[0]**2)
+        ax.errorbar(dj0, dg_mult,
+                    xerr = j0_err, yerr = dg_mult_err,
+                    fmt='.', color='red', linewidth=3, markersize=7, linestyle='none',
+                    label="SCONE (thres. 200 keV)")
 
-    plt.errorbar(dj0, dg_mult,
-                 xerr = j0_err, yerr = dg_mult_err,
-                 fmt='.', color='red', linewidth=3, markersize=7, linestyle='none',
-                 label="SCONE (thres. 200 keV)")
+        # L = 0 assumption
 
-    # L = 0 assumption
+        ymin = g_mult_electrans(j0, s = SNU_MAX, frag_ratio = 1.0, pole = 2)
+        ymax = g_mult_electrans(j0, s = SNU_MIN, frag_ratio = 1.0, pole = 1)
+        dymin = diff_init(ymin)
+        dymax = diff_init(ymax)
 
-    ymin = g_mult_electrans(j0, s = SNU_MAX, frag_ratio = 1.0, pole = 2)
-    ymax = g_mult_electrans(j0, s = SNU_MIN, frag_ratio = 1.0, pole = 1)
-    dymin = diff_init(ymin)
-    dymax = diff_init(ymax)
+        ax.fill_between(dj0, dymin, dymax, 
+                        alpha=0.3, color='saddlebrown', 
+                        label=r'$\Delta{}L=0$')
 
-    plt.fill_between(dj0, dymin, dymax, 
-                     alpha=0.3, color='saddlebrown', 
-                     label=r'$\Delta{}L=0$')
+        # L from microscopic calculations (G. Scamps)
 
-    # L from microscopic calculations (G. Scamps)
+        ymin = g_mult_electrans(j0, s = SNU_MAX, frag_ratio = FRAG_MOM_MICRO, pole = 2)
+        ymax = g_mult_electrans(j0, s = SNU_MIN, frag_ratio = FRAG_MOM_MICRO, pole = 1)
+        dymin = diff_init(ymin)
+        dymax = diff_init(ymax)
 
-    ymin = g_mult_electrans(j0, s = SNU_MAX, frag_ratio = FRAG_MOM_MICRO, pole = 2)
-    ymax = g_mult_electrans(j0, s = SNU_MIN, frag_ratio = FRAG_MOM_MICRO, pole = 1)
-    dymin = diff_init(ymin)
-    dymax = diff_init(ymax)
+        ax.fill_between(dj0, dymin, dymax, 
+                        alpha=0.3, color='blue', 
+                        label=r'$\Delta{}L_\mathrm{TDHF+BCS}$')
 
-    plt.fill_between(dj0, dymin, dymax, 
-                     alpha=0.3, color='blue', 
-                     label=r'$\Delta{}L_\mathrm{TDHF+BCS}$')
+        # legend and annotations
+        
+        ax.legend(loc = 'upper left', frameon=False, title_fontsize=FONT_SIZE)
 
-    # legend and annotations
-    
-    plt.legend(loc = 'upper left', frameon=False, title_fontsize=FONT_SIZE)
+        ax.annotate(r'Pure E2 and 0.5 $\hbar$ / prompt neutron',
+                    ha='center', va='bottom', xytext=(3.8,0.52), xy=(3.,0.52), rotation=21)
+        ax.annotate(r'Pure E1 and 0 $\hbar$ / prompt neutron',
+                    ha='center', va='bottom', xytext=(2.7,1.05), xy=(2.7,1.05), rotation=48)
 
-    plt.annotate(r'Pure E2 and 0.5 $\hbar$ / prompt neutron',
-                 ha='center', va='bottom', xytext=(3.8,0.52), xy=(3.,0.52), rotation=21)
-    plt.annotate(r'Pure E1 and 0 $\hbar$ / prompt neutron',
-                 ha='center', va='bottom', xytext=(2.7,1.05), xy=(2.7,1.05), rotation=48)
+        # save and return 
 
-    # save and return 
+        dir = FIG_DIR/'angmom.pdf'
+        fig.savefig(dir, format="pdf", bbox_inches='tight', dpi=300)
 
-    dir = FIG_DIR/'angmom.pdf'
-    plt.savefig(dir, format="pdf", bbox_inches='tight', dpi=300)
     return dir
 
 
@@ -219,61 +202,69 @@ def parse_filename_label(filename):
 
 
 
-def plot_ab_fit(filenames, mult_range=None):
+@profiled()
+def plot_ab_fit(response=None):
     """
     Plot the fit of A and B SCONE constants from multiple Geant4 simulations.
+
+    Args:
+        response (ResponseDataset or list of str or None): Loaded and fitted Geant4
+            curves, or Geant4 filenames. Defaults to None (ENV.response).
+
+    Returns:
+        (str): Plot file name.
     """
+    if response is None:
+        response = ENV.response
+    elif not isinstance(response, ResponseDataset):
+        response = ResponseDataset(response)
+    filenames = response.filenames
+
+    with styled_figure() as (fig, ax):
+
+        ax.set_xlabel("Emitted gamma-rays multiplicity", size=FONT_SIZE)
+        ax.set_ylabel("Average detected multiplicity (SCONE)", size=FONT_SIZE)
+        ax.set_xlim(0.1, 17.5)
+        ax.set_ylim(0.1, 13.5)
+        ax.set_xticks([0, 4, 8, 12, 16])
+        ax.set_yticks([2, 4, 6, 8, 10, 12])
+
+        colors = mpl.colormaps["tab10"](np.linspace(0, 1, len(filenames)))
+        markers = ["o", "s", "D", "^", "v", ">", "<", "p", "P", "X"]
+
+        # Geant4 data
+        handles_data, labels_data = [], []
+        for i, (fname, (x, y)) in enumerate(zip(filenames, response.curves)):
+            label = parse_filename_label(fname)
+            marker = markers[i % len(markers)]
+            h = ax.scatter(x, y, color=colors[i], s=100, marker=marker, label=label)
+            handles_data.append(h)
+            labels_data.append(label)
+
+        # Global fit (band: constants shifted by 3 sigma in the direction of their effect)
+        model = MODELS[RESPONSE_MODEL]
+        popt, perr = response.popt, np.sqrt(np.diag(response.pcov))
+        xfit = np.linspace(0, 1.1 * max(x), 400)
+        shift = 3 * perr * np.sign(model.jac(np.median(xfit), *popt))
+        yfit = model.forward(xfit, *popt)
+        yfit_min = model.forward(xfit, *(popt - shift))
+        yfit_max = model.forward(xfit, *(popt + shift))
+
+        line_fit, = ax.plot(xfit, yfit, color="black", linewidth=3, label="Average fit")
+        band_fit = ax.fill_between(xfit, yfit_min, yfit_max, color="gray", alpha=0.3, label=r"Fit uncertainty (3$\sigma$)")
+
+        # --- Two separate legends ---
+        order = sorted(range(len(labels_data)), key=lambda i: 0 if "252Cf" in labels_data[i] else 1)
+        handles_data = [handles_data[i] for i in order]
+        labels_data = [labels_data[i] for i in order]
+        legend1 = ax.legend(handles=handles_data, labels=labels_data, loc='upper left', frameon=False)
+        ax.add_artist(legend1)
+
+        handles_fit = [line_fit, band_fit]
+        labels_fit = ["Average fit", r"Fit uncertainty (3$\sigma$)"]
+        ax.legend(handles_fit, labels_fit, loc='lower right', frameon=False)
+
+        savename = "AB_fit.pdf"
+        fig.savefig(FIG_DIR / savename, format="pdf", bbox_inches='tight', dpi=300)
 
-    fig, ax = plt.subplots(figsize=(10, 10))
-    fig.tight_layout()
-    ax.xaxis.set_tick_params(which='major', size=10, width=2, direction='in', top='on')
-    ax.xaxis.set_tick_params(which='minor', size=7, width=2, direction='in', top='on')
-    ax.yaxis.set_tick_params(which='major', size=10, width=2, direction='in', right='on')
-    ax.yaxis.set_tick_params(which='minor', size=7, width=2, direction='in', right='on')
-    plt.xticks(fontsize=FONT_SIZE)
-    plt.yticks(fontsize=FONT_SIZE)
-    plt.xlabel("Emitted gamma-rays multiplicity", size=FONT_SIZE)
-    plt.ylabel("Average detected multiplicity (SCONE)", size=FONT_SIZE)
-    ax.set_xlim(0.1, 17.5)
-    ax.set_ylim(0.1, 13.5)
-    ax.set_xticks([0, 4, 8, 12, 16])
-    ax.set_yticks([2, 4, 6, 8, 10, 12])
-
-    colors = plt.cm.tab10(np.linspace(0, 1, len(filenames)))
-    markers = ["o", "s", "D", "^", "v", ">", "<", "p", "P", "X"]
-
-    # Geant4 data
-    handles_data, labels_data = [], []
-    for i, fname in enumerate(filenames):
-        label = parse_filename_label(fname)
-        x, y = fission_gcasc_resp(fname, mult_range=mult_range)
-        marker = markers[i % len(markers)]
-        h = ax.scatter(x, y, color=colors[i], s=100, marker=marker, label=label)
-        handles_data.append(h)
-        labels_data.append(label)
-
-    # Global fit
-    a, b, da, db = fit_scone_gconst_multiple(FILENAMES)
-    print(a, b, da, db)
-    xfit = np.linspace(0, 1.1 * max(x), 400)
-    yfit = g_mult_scone(a, b, xfit)
-    yfit_min = g_mult_scone(a - 3*da, b + 3*db, xfit)
-    yfit_max = g_mult_scone(a + 3*da, b - 3*db, xfit)
-
-    line_fit, = ax.plot(xfit, yfit, color="black", linewidth=3, label="Average fit")
-    band_fit = ax.fill_between(xfit, yfit_min, yfit_max, color="gray", alpha=0.3, label=r"Fit uncertainty (3$\sigma$)")
-
-    # --- Two separate legends ---
-    order = sorted(range(len(labels_data)), key=lambda i: 0 if "252Cf" in labels_data[i] else 1)
-    handles_data = [handles_data[i] for i in order]
-    labels_data = [labels_data[i] for i in order]
-    legend1 = ax.legend(handles=handles_data, labels=labels_data, loc='upper left', frameon=False)
-    ax.add_artist(legend1)
-
-    handles_fit = [line_fit, band_fit]
-    labels_fit = ["Average fit", r"Fit uncertainty (3$\sigma$)"]
-    ax.legend(handles_fit, labels_fit, loc='lower right', frameon=False)
-
-    savename = "AB_fit.pdf"
-    plt.savefig(FIG_DIR / savename, format="pdf", bbox_inches='tight', dpi=300)
     return savename
\ No newline at end of file
@@ -0,0 +1,262 @@
+""" Stage-level profiling of the pipeline (wall time, CPU time, memory, array sizes) """
+
+# librairies
+
+import os
+import sys
+import json
+import time
+import atexit
+import platform
+import resource
+import functools
+from pathlib import Path
+
+# profiling is off unless GASCONE_PROFILE is set ("1" for the default output file, or a path)
+
+PROFILE_ENV = "GASCONE_PROFILE"
+
+# class
+
+
+class Stage:
+    """
+    Timer of one pipeline stage, nested in the stage open when it starts.
+    Records wall and CPU times, the resident memory change, the process peak
+    resident memory at the end of the stage, and the sizes of recorded arrays.
+
+    Args:
+        name (str): Name of the stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.children = []
+        self.arrays = {}
+        self.wall = self.cpu = self.rss_delta = self.rss_peak = None
+
+    def record(self, **arrays):
+        """
+        Record the shape and size of arrays produced or used by the stage.
+        """
+        for key, value in arrays.items():
+            self.arrays[key] = {"shape": list(getattr(value, "shape", ())), "nbytes": int(getattr(value, "nbytes", 0))}
+
+    def __enter__(self):
+        _STACK[-1].children.append(self)
+        _STACK.append(self)
+        self._rss0 = current_rss()
+        self._cpu0 = time.process_time()
+        self._wall0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall = time.perf_counter() - self._wall0
+        self.cpu = time.process_time() - self._cpu0
+        self.rss_delta = current_rss() - self._rss0
+        self.rss_peak = peak_rss()
+        _STACK.pop()
+        return False
+
+    def to_dict(self):
+        return {
+            "name": self.name, "wall": self.wall, "cpu": self.cpu,
+            "rss_delta": self.rss_delta, "rss_peak": self.rss_peak,
+            "arrays": self.arrays, "children": [c.to_dict() for c in self.children],
+        }
+
+
+class _Record:
+    """
+    Stage recorded by another process (see profile_call), attached as is.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def to_dict(self):
+        return self.data
+
+
+class _NoStage:
+    """
+    Stage of a disabled profiler: does nothing.
+    """
+
+    def record(self, **arrays):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_STAGE = _NoStage()
+_ROOT = Stage("run")
+_STACK = [_ROOT]
+_STATE = {"enabled": False, "path": None, "pid": None, "start": None}
+
+# functions
+
+
+def current_rss():
+    """
+    Current resident memory of the process [bytes] (0 if unavailable).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def peak_rss():
+    """
+    Peak resident memory of the process since its start [bytes].
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def enabled():
+    return _STATE["enabled"]
+
+
+def enable(path=None):
+    """
+    Turn profiling on for this process; the profile is written at exit.
+
+    Args:
+        path (str or Path or None): Output JSON file. Defaults to None
+            (outputs/profile_<date>_<time>.json).
+    """
+    if _STATE["enabled"]:
+        return
+    _STATE.update(enabled=True, path=path, pid=os.getpid(), start=time.time())
+
+    # the root stage stays open for the whole run
+
+    _ROOT._wall0, _ROOT._cpu0, _ROOT._rss0 = time.perf_counter(), time.process_time(), current_rss()
+    atexit.register(write_profile)
+
+
+def stage(name):
+    """
+    Nested timer of a pipeline stage, as a context manager:
+
+        with stage("unfold") as st:
+            ...
+            st.record(g_mult=g_mult)
+
+    Args:
+        name (str): Name of the stage.
+
+    Returns:
+        (Stage): Stage timer (a shared no-op object when profiling is off).
+    """
+    return Stage(name) if _STATE["enabled"] else _NO_STAGE
+
+
+def profiled(name=None):
+    """
+    Decorator timing every call of a function as a stage (one flag test when off).
+
+    Args:
+        name (str or None): Name of the stage. Defaults to None (function name).
+    """
+    def decorator(func):
+        label = func.__name__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _STATE["enabled"]:
+                return func(*args, **kwargs)
+            with Stage(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profile_call(name, func, *args, **kwargs):
+    """
+    Call a function under a stage of its own, outside of the stage tree of the
+    process (e.g. in a worker process, whose stages would otherwise be lost).
+
+    Args:
+        name (str): Name of the stage.
+        func (callable): Function to call with args and kwargs.
+
+    Returns:
+        (object): Result of the call.
+        (dict): Stage record of the call, to attach in the parent process.
+    """
+    saved, enabled = _STACK[:], _STATE["enabled"]
+    _STACK[:] = [Stage(None)]
+    _STATE["enabled"] = True
+    try:
+        with Stage(name) as st:
+            result = func(*args, **kwargs)
+    finally:
+        _STACK[:] = saved
+        _STATE["enabled"] = enabled
+    return result, st.to_dict()
+
+
+def attach(records):
+    """
+    Attach stage records of other processes (profile_call) to the open stage.
+
+    Args:
+        records (list of dict): Stage records.
+    """
+    if _STATE["enabled"]:
+        _STACK[-1].children.extend(_Record(r) for r in records)
+
+
+def profile_dict():
+    """
+    Profile of the run so far, as a JSON-serializable dict.
+    """
+    _ROOT.wall = time.perf_counter() - _ROOT._wall0
+    _ROOT.cpu = time.process_time() - _ROOT._cpu0
+    _ROOT.rss_delta = current_rss() - _ROOT._rss0
+    _ROOT.rss_peak = peak_rss()
+    return {
+        "version": 1,
+        "start": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(_STATE["start"])),
+        "argv": sys.argv,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "profile": _ROOT.to_dict(),
+    }
+
+
+def write_profile(path=None):
+    """
+    Write the JSON profile of the run (only from the process that enabled it).
+
+    Args:
+        path (str or Path or None): Output JSON file. Defaults to the path given to enable.
+
+    Returns:
+        (Path or None): Path of the profile.
+    """
+    if not _STATE["enabled"] or os.getpid() != _STATE["pid"]:
+        return None
+    path = path or _STATE["path"]
+    if path is None:
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(_STATE["start"]))
+        path = Path(__file__).resolve().parent/"outputs"/f"profile_{stamp}.json"
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(profile_dict(), f, indent=1)
+    return path
+
+
+# activation from the environment
+
+if os.environ.get(PROFILE_ENV, "") not in ("", "0"):
+    enable(None if os.environ[PROFILE_ENV] == "1" else os.environ[PROFILE_ENV])
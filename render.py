@@ -0,0 +1,146 @@
+""" Headless figure rendering: styled templates and a process pool """
+
+# librairies
+
+import os
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib as mpl
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from env import FONT_SIZE
+from profiling import enabled, profile_call
+
+# plots design (applied with rc_context, never globally)
+
+STYLE = {
+    'font.size': FONT_SIZE,
+    'mathtext.fontset': 'stix',
+    'font.family': 'STIXGeneral',
+    'pdf.fonttype': 42, # TrueType fonts (text not converted to paths)
+    'ps.fonttype': 42,
+    'lines.linewidth': 1.0,
+    'axes.linewidth': 1.0,
+}
+
+# functions
+
+
+def style_axes(ax, fontsize=FONT_SIZE):
+    """
+    Ticks of the shared template: inward on the four sides, large labels.
+
+    Args:
+        ax (Axes): Axes to style.
+        fontsize (int): Tick labels size. Defaults to FONT_SIZE.
+    """
+    ax.xaxis.set_tick_params(which='major', size=10, width=2, direction='in', top=True)
+    ax.xaxis.set_tick_params(which='minor', size=7, width=2, direction='in', top=True)
+    ax.yaxis.set_tick_params(which='major', size=10, width=2, direction='in', right=True)
+    ax.yaxis.set_tick_params(which='minor', size=7, width=2, direction='in', right=True)
+    ax.tick_params(labelsize=fontsize)
+
+
+@contextmanager
+def styled_figure(figsize=(10, 10)):
+    """
+    Figure of the shared template, drawn with the Agg canvas whatever the
+    pyplot backend, and outside of pyplot so that nothing keeps a reference
+    to it. Styles apply within the block only (savefig inside the block);
+    the figure is cleared on exit.
+
+    Args:
+        figsize (tuple): Figure size [inches]. Defaults to (10, 10).
+
+    Yields:
+        (Figure): Figure.
+        (Axes): Styled axes.
+    """
+    with mpl.rc_context(STYLE):
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        ax = fig.subplots()
+        fig.tight_layout()
+        style_axes(ax)
+        try:
+            yield fig, ax
+        finally:
+            fig.clear()
+
+
+def _render(job):
+    """
+    Run one plotting job (func, args, kwargs, profile) in a worker.
+
+    Returns:
+        (object): Result of the plotting function.
+        (dict or None): Stage record of the job if profiled (see profiling.profile_call).
+    """
+    func, args, kwargs, profile = job
+    if profile:
+        return profile_call(func.__name__, func, *args, **kwargs)
+    return func(*args, **kwargs), None
+
+
+class FigurePool:
+    """
+    Concurrent rendering of independent figures over a process pool, so that
+    plotting runs beside the analysis. Used as a context manager, it waits for
+    every figure on exit and raises the first rendering error. When profiling
+    is on, the stages of each job are recorded in its worker and sent back
+    with its result (see records).
+
+    Args:
+        n_workers (int or None): Number of processes (0 renders in-process at
+            submission). Defaults to None (min(4, CPUs)).
+    """
+
+    def __init__(self, n_workers=None):
+        self.n_workers = min(4, os.cpu_count()) if n_workers is None else n_workers
+        self.pool = ProcessPoolExecutor(max_workers=self.n_workers) if self.n_workers > 0 else None
+        self.futures = []
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Render a figure with a plotting function (picklable, module level).
+
+        Returns:
+            (Future or object): Future of (result, stage record) (result itself if in-process).
+        """
+        if self.pool is None:
+            result = func(*args, **kwargs)
+            self.futures.append((result, None))
+            return result
+        future = self.pool.submit(_render, (func, args, kwargs, enabled()))
+        self.futures.append(future)
+        return future
+
+    def _outputs(self):
+        """
+        (result, stage record) of all submitted figures, in submission order (blocking).
+        """
+        return [f.result() if self.pool is not None else f for f in self.futures]
+
+    def results(self):
+        """
+        Results of all submitted figures, in submission order (blocking).
+        """
+        return [result for result, _ in self._outputs()]
+
+    def records(self):
+        """
+        Stage records of the figures rendered by the workers while profiling (blocking).
+        """
+        return [record for _, record in self._outputs() if record is not None]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.results()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown(wait=True, cancel_futures=exc_type is not None)
+        return False
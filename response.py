@@ -4,8 +4,18 @@
 # imports
 
 
+import re
 from env import *
-from scipy.optimize import fsolve, curve_fit
+from scipy.optimize import curve_fit
+from cache import file_hash, cache_key, cache_load, cache_save
+from models import MODELS, fit_model_batched, information_criteria
+from profiling import profiled
+
+
+# global fit settings (initial trial and bounds: see the model in models.py)
+
+
+FIT_MAXFEV = 20000
 
 
 # functions
@@ -23,65 +33,73 @@ def g_mult_scone(a, b, g_mult_casc):
     Returns:
         g_mult_scone (narray): Gamma-rays multiplicity measured by SCONE.
     """
-    g_mult_scone = a*(1.0-np.exp(-g_mult_casc/b))
+    g_mult_scone = MODELS["exp"].forward(g_mult_casc, a, b)
     return g_mult_scone
 
 
-def g_mult_scone_inv(a, b, g_mult_scone):
+def g_mult_scone_inv(a, b, g_mult_scone, max_ratio=None):
     """
-    Inverse of SCONE response function to gamma-rays.
+    Inverse of SCONE response function to gamma-rays (closed form).
+    All arguments are broadcast together, so that arrays of sampled (a, b)
+    constants and measurements of any shape are inverted at once.
 
     Args:
-        a (float): First SCONE gamma-rays constant.
-        b (float): Sedond SCONE gamma-rays constant.
-        g_mult_scone (narray): Gamma-rays multiplicity measured by SCONE.
+        a (float or narray): First SCONE gamma-rays constant.
+        b (float or narray): Sedond SCONE gamma-rays constant.
+        g_mult_scone (float or narray): Gamma-rays multiplicity measured by SCONE.
+        max_ratio (float or None): If given (< 1), g_mult_scone/a is clipped to
+            this value before inversion. Otherwise, values outside the physical
+            domain (g_mult_scone >= a, or a, b <= 0) return NaN. Defaults to None.
 
     Returns:
-        g_mult_casc (narray): Gamma-rays multiplicity of a fission cascade.
+        g_mult_casc (float or narray): Gamma-rays multiplicity of a fission cascade.
     """
-    g_mult_casc = fsolve(lambda x: g_mult_scone(a,b,x)-g_mult_scone,1.)
-    return g_mult_casc
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    ratio = np.asarray(g_mult_scone, dtype=float) / a
+
+    if max_ratio is not None:
+        ratio = np.minimum(ratio, max_ratio)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g_mult_casc = MODELS["exp"].inverse(ratio * a, a, b)
 
+    # physical domain
 
-def fission_gcasc_resp(filename, mult_range=None):
+    valid = (ratio < 1.) & (a > 0.) & (b > 0.)
+    g_mult_casc = np.where(valid, g_mult_casc, np.nan)
+
+    return g_mult_casc[()]
+
+
+@profiled()
+def fission_gcasc_resp(filename, mult_range=None, sparse=False):
     """
     Extract the average SCONE response to fission gamma-rays from GEANT4 simulations.
 
     Args:
         filename (str): _description_. Defaults to "data/geant4/Geant4_238U_1MeV.txt".
         mult_range (tuple or None): (min, max) range of emitted multiplicity to keep. Defaults to None.
+        sparse (bool): Read the response as a sparse matrix, never densified. Defaults to False.
 
     Returns:
         emitted_mult (narray): Mean emitted gamma-rays multiplicity by fission.
         detected_mult (narray): Mean detected gamma-rays multiplicity by SCONE.
     """
-    # reading 
-
-    simu = np.loadtxt(GEANT4_DIR/filename)
-
-    # extracting full response
+    # reading full response (detected x emitted grid)
 
-    X_simu = simu[:,0]
-    Y_simu = simu[:,1]
-    Z_simu = simu[:,2]
-    df_simu = pd.DataFrame({'X':X_simu,'Y':Y_simu,'Z':Z_simu})
-    Z_pivot = df_simu.pivot(index='Y',columns='X',values='Z')
+    emitted_all, detected_all, Z_pivot = read_matrix(GEANT4_DIR/filename, sparse=sparse)
 
     # delete empty columns
 
-    col_sums = Z_pivot.sum(axis=0).to_numpy()
-    good_cols = col_sums > 0
-    Z_pivot = Z_pivot.loc[:, good_cols]
+    col_sums = np.asarray(Z_pivot.sum(axis=0)).ravel()
+    good_cols = np.flatnonzero(col_sums > 0)
+    Z_pivot = Z_pivot[:, good_cols]
 
-    # normalization
+    # average response (normalized columns)
 
-    Z_norm = Z_pivot.div(Z_pivot.sum(axis=0), axis=1)
-
-    # average response
-
-    y_vals = Z_norm.index.values[:, None]
-    mean_Y = (y_vals * Z_norm.values).sum(axis=0) / Z_norm.values.sum(axis=0)
-    emitted_mult = Z_norm.columns.values
+    mean_Y = (Z_pivot.T @ detected_all) / col_sums[good_cols]
+    emitted_mult = emitted_all[good_cols]
     detected_mult = np.asarray(mean_Y)
 
     # security 
@@ -101,6 +119,49 @@ def fission_gcasc_resp(filename, mult_range=None):
     return emitted_mult, detected_mult
 
 
+def fission_gcasc_matrix(filenames, sparse=False):
+    """
+    Full SCONE response matrix to fission gamma-rays from GEANT4 simulations.
+    The events of several files are pooled before normalization. Bin-centred
+    axes (0.5, 1.5, ...) are mapped to their integer multiplicity.
+
+    Args:
+        filenames (str or list of str): Geant4 simulation filename(s).
+        sparse (bool): Build a sparse (CSC) response, never densified. Defaults to False.
+
+    Returns:
+        emitted_mult (narray): Emitted gamma-rays multiplicities with simulated events.
+        detected_mult (narray): Detected gamma-rays multiplicity axis.
+        resp (narray or csc_array): P(detected | emitted), shape (len(detected_mult), len(emitted_mult)).
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+
+    # pooled counts
+
+    counts = None
+    for fname in filenames:
+        emitted_all, detected_all, Z = read_matrix(GEANT4_DIR/fname, sparse=sparse)
+        emitted_all, detected_all = np.floor(emitted_all), np.floor(detected_all)
+        if counts is None:
+            axes, counts = (emitted_all, detected_all), Z.astype(float, copy=True)
+        elif not (np.array_equal(axes[0], emitted_all) and np.array_equal(axes[1], detected_all)):
+            raise ValueError(f"Geant4 grid of {fname} differs from {filenames[0]}")
+        else:
+            counts = counts + Z
+
+    # normalization of simulated emitted multiplicities
+
+    col_sums = np.asarray(counts.sum(axis=0)).ravel()
+    good_cols = np.flatnonzero(col_sums > 0)
+    if sparse:
+        resp = counts[:, good_cols].multiply(1. / col_sums[good_cols]).tocsc()
+    else:
+        resp = counts[:, good_cols] / col_sums[good_cols]
+
+    return axes[0][good_cols], axes[1], resp
+
+
 def fit_scone_gconst(emitted_mult, detected_mult):
     """
     Extract the average SCONE response to fission gamma-rays from GEANT4 simulations.
@@ -133,40 +194,336 @@ def fit_scone_gconst(emitted_mult, detected_mult):
 
 
 
-def fit_scone_gconst_multiple(filenames, mult_range=None):
+def response_curves(filenames, mult_range=None):
     """
-    Fit the SCONE gamma-ray response constants A and B for several cascades.
+    Finite Geant4 response curves of SCONE to fission cascades.
 
     Args:
         filenames (list of str): List of Geant4 simulation filenames.
         mult_range (tuple or None): (min, max) range of emitted multiplicity to keep. Defaults to None.
 
     Returns:
-        a (float): Mean fitted a constant.
-        b (float): Mean fitted b constant.
-        a_err (float): Standard deviation of fitted a.
-        b_err (float): Standard deviation of fitted b.
+        (list of tuple): (emitted_mult, detected_mult) of each file.
     """
-
-    xs, ys = [], []
+    curves = []
 
     for fname in filenames:
         x, y = fission_gcasc_resp(fname, mult_range=mult_range)
         finite = np.isfinite(x) & np.isfinite(y)
-        xs.append(x[finite])
-        ys.append(y[finite])
+        curves.append((x[finite], y[finite]))
 
-    X = np.concatenate(xs)
-    Y = np.concatenate(ys)
+    return curves
 
-    popt, pcov = curve_fit(
-        lambda t, A, B: g_mult_scone(A, B, t),
+
+def fit_response_curves(curves, model=RESPONSE_MODEL):
+    """
+    Global fit of the SCONE gamma-ray response constants on response curves.
+
+    Args:
+        curves (list of tuple): (emitted_mult, detected_mult) of each file.
+        model (str): Response model of MODELS. Defaults to RESPONSE_MODEL.
+
+    Returns:
+        popt (narray): Fitted constants ((a, b) for "exp").
+        pcov (narray): Covariance matrix of the constants.
+    """
+    X = np.concatenate([x for x, _ in curves])
+    Y = np.concatenate([y for _, y in curves])
+    model = MODELS[model]
+
+    return curve_fit(
+        lambda t, *p: model.forward(t, *p),
         X, Y,
-        p0=[20, 30],
-        bounds=(0, np.inf),
-        maxfev=20000
+        p0=model.p0,
+        bounds=(model.lower, model.upper),
+        maxfev=FIT_MAXFEV
+    )
+
+
+@profiled()
+def fit_scone_response(filenames, mult_range=None, use_cache=True):
+    """
+    Global fit of the SCONE gamma-ray response on several Geant4 cascades.
+    The result is cached on disk under a key built from the content of the
+    Geant4 files, mult_range and the fit settings, so that it is recomputed
+    only when one of them changes.
+
+    Args:
+        filenames (list of str): List of Geant4 simulation filenames.
+        mult_range (tuple or None): (min, max) range of emitted multiplicity to keep. Defaults to None.
+        use_cache (bool): Read and write the on-disk cache. Defaults to True.
+
+    Returns:
+        popt (narray): Fitted constants of RESPONSE_MODEL ((a, b) for "exp").
+        pcov (narray): Covariance matrix of the constants.
+        curves (list of tuple): (emitted_mult, detected_mult) of each file.
+    """
+
+    key = cache_key(
+        [file_hash(GEANT4_DIR/fname) for fname in filenames],
+        None if mult_range is None else list(mult_range),
+        RESPONSE_MODEL, MODELS[RESPONSE_MODEL].p0.tolist(), FIT_MAXFEV
     )
+
+    if use_cache:
+        cached = cache_load("scone_gconst", key)
+        if cached is not None:
+            bounds = np.cumsum(cached["sizes"])[:-1]
+            curves = list(zip(np.split(cached["emitted"], bounds), np.split(cached["detected"], bounds)))
+            return cached["popt"], cached["pcov"], curves
+
+    curves = response_curves(filenames, mult_range=mult_range)
+    popt, pcov = fit_response_curves(curves)
+
+    if use_cache:
+        cache_save(
+            "scone_gconst", key,
+            popt=popt, pcov=pcov,
+            emitted=np.concatenate([x for x, _ in curves]),
+            detected=np.concatenate([y for _, y in curves]),
+            sizes=np.array([len(x) for x, _ in curves])
+        )
+
+    return popt, pcov, curves
+
+
+class ResponseDataset:
+    """
+    Geant4 response curves of SCONE to fission cascades and their global fit,
+    loaded and fitted once at construction (through the on-disk cache of
+    fit_scone_response) and then shared by the unfolding and the plots.
+
+    Args:
+        filenames (list of str): List of Geant4 simulation filenames.
+        mult_range (tuple or None): (min, max) range of emitted multiplicity to keep. Defaults to None.
+        use_cache (bool): Read and write the on-disk cache. Defaults to True.
+    """
+
+    def __init__(self, filenames, mult_range=None, use_cache=True):
+        self.filenames = list(filenames)
+        self.mult_range = mult_range
+        self.popt, self.pcov, self.curves = fit_scone_response(self.filenames, mult_range=mult_range, use_cache=use_cache)
+
+    @classmethod
+    def from_fit(cls, filenames, popt, pcov, curves, mult_range=None):
+        """
+        Dataset of already loaded curves and fit results (no reading nor fit).
+
+        Args:
+            filenames (list of str): List of Geant4 simulation filenames.
+            popt (narray): Fitted (a, b) constants.
+            pcov (narray): 2x2 covariance matrix of (a, b).
+            curves (list of tuple): (emitted_mult, detected_mult) of each file.
+            mult_range (tuple or None): Range of emitted multiplicity of the curves. Defaults to None.
+
+        Returns:
+            (ResponseDataset): Dataset.
+        """
+        dataset = cls.__new__(cls)
+        dataset.filenames, dataset.mult_range = list(filenames), mult_range
+        dataset.popt, dataset.pcov, dataset.curves = popt, pcov, list(curves)
+        return dataset
+
+    @property
+    def gconst(self):
+        """
+        Fitted constants then their errors ((a, b, a_err, b_err) for "exp").
+        """
+        return (*self.popt, *np.sqrt(np.diag(self.pcov)))
+
+
+def fit_scone_gconst_multiple(filenames, mult_range=None):
+    """
+    Fit the SCONE gamma-ray response constants A and B for several cascades.
+
+    Args:
+        filenames (list of str): List of Geant4 simulation filenames.
+        mult_range (tuple or None): (min, max) range of emitted multiplicity to keep. Defaults to None.
+
+    Returns:
+        a (float): Mean fitted a constant.
+        b (float): Mean fitted b constant.
+        a_err (float): Standard deviation of fitted a.
+        b_err (float): Standard deviation of fitted b.
+    """
+
+    popt, pcov, _ = fit_scone_response(filenames, mult_range=mult_range)
     a, b = popt
     a_err, b_err = np.sqrt(np.diag(pcov))
 
     return a, b, a_err, b_err
+
+
+def geant4_file_info(filename):
+    """
+    Cascade generator, target and incident neutron energy of a Geant4 file,
+    from its name "Geant4_<generator>_<target>[_<energy>MeV].txt". Files
+    without incident energy (spontaneous fission, e.g. 252Cf) get None.
+
+    Args:
+        filename (str): Geant4 simulation filename.
+
+    Returns:
+        (dict): "generator", "target" and "energy" [MeV] (None for spontaneous fission).
+    """
+    match = re.fullmatch(r"Geant4_([^_]+)_([^_]+?)(?:_([\d.]+)MeV)?\.\w+", Path(filename).name)
+    if match is None:
+        raise ValueError(f"Unexpected Geant4 filename: {filename}")
+    generator, target, energy = match.groups()
+    return {"generator": generator, "target": target, "energy": None if energy is None else float(energy)}
+
+
+def fit_scone_response_files(filenames, mult_range=None):
+    """
+    Fit the SCONE gamma-ray response constants of each Geant4 file separately
+    (each fit is cached on disk, see fit_scone_response).
+
+    Args:
+        filenames (list of str): List of Geant4 simulation filenames.
+        mult_range (tuple or None): (min, max) range of emitted multiplicity to keep. Defaults to None.
+
+    Returns:
+        popts (narray): Fitted constants, shape (files, model parameters).
+        pcovs (narray): Covariance matrices of the constants, shape (files, params, params).
+    """
+    fits = [fit_scone_response([fname], mult_range=mult_range)[:2] for fname in filenames]
+    return np.array([f[0] for f in fits]), np.array([f[1] for f in fits])
+
+
+def response_table(energies, filenames, target=None, generator=None, mult_range=None):
+    """
+    Energy-dependent SCONE gamma-ray response constants on a grid of incident
+    energies, from the neutron-induced fission files of one target (spontaneous
+    fission files have no incident energy and are left out). Each file is fitted once, files at the same incident energy are
+    combined with their inverse covariances, and the constants are linearly
+    interpolated between energies (constant beyond the simulated range).
+    The interpolation is linear in the node constants, so that the table
+    carries the propagated covariance of each energy.
+
+    Args:
+        energies (narray): Incident neutron energies of the table [MeV].
+        filenames (list of str): List of Geant4 simulation filenames.
+        target (str or None): Keep only the files of this fissioning target. Defaults to None (all).
+        generator (str or None): Keep only the files of this cascade generator. Defaults to None (all).
+        mult_range (tuple or None): (min, max) range of emitted multiplicity to keep. Defaults to None.
+
+    Returns:
+        *params (narray): Each constant of RESPONSE_MODEL per energy (a, b for "exp").
+        cov (narray): Covariance matrices of the constants, shape (energies, params, params).
+    """
+    energies = np.asarray(energies, dtype=float)
+    infos = [geant4_file_info(f) for f in filenames]
+    filenames = [
+        f for f, info in zip(filenames, infos)
+        if info["energy"] is not None
+        and (target is None or info["target"] == target)
+        and (generator is None or info["generator"] == generator)
+    ]
+    if len(filenames) == 0:
+        raise ValueError(f"No neutron-induced Geant4 file for target {target} and generator {generator}")
+
+    # one fit per file, combined per incident energy
+
+    popts, pcovs = fit_scone_response_files(filenames, mult_range=mult_range)
+    file_energies = np.array([geant4_file_info(f)["energy"] for f in filenames])
+    nodes, inverse = np.unique(file_energies, return_inverse=True)
+
+    inv = np.linalg.inv(pcovs)
+    node_cov = np.linalg.inv(np.array([inv[inverse == i].sum(axis=0) for i in range(nodes.size)]))
+    info = np.einsum('fij,fj->fi', inv, popts)
+    node_popt = np.einsum('nij,nj->ni', node_cov, np.array([info[inverse == i].sum(axis=0) for i in range(nodes.size)]))
+
+    # linear interpolation weights (energies, nodes)
+
+    weights = np.column_stack([np.interp(energies, nodes, row) for row in np.eye(nodes.size)])
+
+    params = (weights @ node_popt).T
+    cov = np.einsum('en,nij->eij', weights**2, node_cov)
+
+    return (*params, cov)
+
+
+def fit_response_models(filenames, models=None, mult_range=None):
+    """
+    Fit every response model of the registry to every Geant4 file, one
+    batched fit per model over all files, and compute information criteria.
+
+    Args:
+        filenames (list of str): List of Geant4 simulation filenames.
+        models (list of str or None): Names of models in MODELS. Defaults to None (all).
+        mult_range (tuple or None): (min, max) range of emitted multiplicity to keep. Defaults to None.
+
+    Returns:
+        (dict): For each model, a dict of "popt" (files, params), "pcov" (files, params, params),
+            "rss", "aic", "bic" (files,) and the totals "aic_total", "bic_total" over files.
+    """
+    models = list(MODELS) if models is None else models
+
+    # padded curves (files, points)
+
+    curves = [fission_gcasc_resp(fname, mult_range=mult_range) for fname in filenames]
+    n_max = max(len(x) for x, _ in curves)
+    x = np.zeros((len(curves), n_max))
+    y = np.zeros((len(curves), n_max))
+    mask = np.zeros((len(curves), n_max), dtype=bool)
+    for i, (xi, yi) in enumerate(curves):
+        x[i, :len(xi)], y[i, :len(yi)], mask[i, :len(xi)] = xi, yi, True
+    n_points = mask.sum(axis=1)
+
+    # fits and criteria
+
+    results = {}
+    for name in models:
+        model = MODELS[name]
+        popt, pcov, rss = fit_model_batched(model, x, y, mask)
+        aic, bic = information_criteria(rss, n_points, model.n_params)
+        aic_total, bic_total = information_criteria(rss.sum(), n_points.sum(), model.n_params * len(curves))
+        results[name] = {
+            "popt": popt, "pcov": pcov, "rss": rss, "aic": aic, "bic": bic,
+            "aic_total": aic_total, "bic_total": bic_total
+        }
+
+    return results
+
+
+def rank_response_models(results, criterion="bic"):
+    """
+    Rank fitted response models by an information criterion summed over files.
+
+    Args:
+        results (dict): Output of fit_response_models.
+        criterion (str): "aic" or "bic". Defaults to "bic".
+
+    Returns:
+        (pd.DataFrame): Models sorted from best to worst, with the criterion difference to the best.
+    """
+    import pandas as pd # imported on first use only (slow import)
+
+    table = pd.DataFrame({
+        "model": list(results),
+        "n_params": [MODELS[name].n_params for name in results],
+        "aic": [r["aic_total"] for r in results.values()],
+        "bic": [r["bic_total"] for r in results.values()],
+    }).sort_values(criterion, ignore_index=True)
+    table["delta"] = table[criterion] - table[criterion].iloc[0]
+    return table
+
+
+# run
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Comparison of SCONE response models on Geant4 simulations")
+    parser.add_argument("files", nargs="*", default=RESPONSE_FILES, help="Geant4 files of data/geant4/")
+    parser.add_argument("-c", "--criterion", choices=("aic", "bic"), default="bic", help="ranking criterion")
+    args = parser.parse_args()
+
+    results = fit_response_models(args.files)
+    print(rank_response_models(results, args.criterion).to_string(index=False))
+    for name, r in results.items():
+        print(f"\n{name} {MODELS[name].param_names}")
+        for fname, p in zip(args.files, r["popt"]):
+            print(f"  {fname}: {np.array2string(p, precision=4)}")
@@ -0,0 +1,238 @@
+""" Global sensitivity analysis (Sobol indices) of the unfolded multiplicity """
+
+
+# librairies
+
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from env import *
+from unfolding import gamma_unfolding, ng_pileup, resolve_params
+from merging import merge_windows
+
+
+# functions
+
+
+def cholesky_psd(cov):
+    """
+    Lower-triangular factor of a covariance matrix with fixed (zero-variance)
+    parameters: the inputs are decorrelated in their order, so that the
+    factor of a parameter holds its part independent of the previous ones.
+
+    Args:
+        cov (narray): Covariance, shape (k, k) or (energies, k, k).
+
+    Returns:
+        (narray): Factor L with L L' = cov, same shape.
+    """
+    cov = np.asarray(cov, dtype=float)
+    free = np.flatnonzero(np.diagonal(cov, axis1=-2, axis2=-1).reshape(-1, cov.shape[-1]).max(axis=0) > 0)
+    factor = np.zeros_like(cov)
+    factor[..., free[:, None], free] = np.linalg.cholesky(cov[..., free[:, None], free])
+    return factor
+
+
+class UnfoldingModel:
+    """
+    Unfolding chain as a function of independent standard normal inputs, for
+    sensitivity analysis. Inputs are grouped by factor: the five parameters
+    (PARAM_NAMES, decorrelated by cholesky_psd), JEFF nubar and the counting
+    statistics (one normal per energy each).
+
+    Args:
+        energies (narray): Incident neutron energies [MeV].
+        g_mult_raw (narray): Raw measurements of gamma-rays multiplicity by SCONE.
+        stat_err (narray): 1-sigma statistical error of g_mult_raw.
+        params (narray or None): Parameters (PARAM_NAMES). Defaults to ENV.params_at(energies).
+        params_cov (narray or None): Parameters covariance. Defaults to ENV.params_at(energies).
+        nubar (tuple or None): (nubar, nubar_err) of the target per energy. Defaults to JEFF 238U.
+    """
+
+    def __init__(self, energies, g_mult_raw, stat_err, params=None, params_cov=None, nubar=None):
+        self.energies = np.asarray(energies, dtype=float)
+        self.g_mult_raw = np.asarray(g_mult_raw, dtype=float)
+        self.stat_err = np.asarray(stat_err, dtype=float)
+        self.params, params_cov = resolve_params(energies, params, params_cov)
+        self.factor = cholesky_psd(params_cov)
+        self.nubar, self.nubar_err = (ENV.nubar_jeff, ENV.nubar_jeff_err) if nubar is None else nubar
+
+        # factors and their columns in the input matrix
+
+        n_p, n_e = len(PARAM_NAMES), self.energies.size
+        self.names = list(PARAM_NAMES) + ["nubar", "stat"]
+        self.groups = [[i] for i in range(n_p)] + [list(range(n_p, n_p + n_e)), list(range(n_p + n_e, n_p + 2 * n_e))]
+        self.n_inputs = n_p + 2 * n_e
+
+    def __call__(self, z):
+        """
+        Unfolded multiplicities for rows of standard normal inputs.
+
+        Args:
+            z (narray): Inputs, shape (n, n_inputs).
+
+        Returns:
+            (narray): Unfolded multiplicities, shape (n, energies).
+        """
+        n_p, n_e = len(PARAM_NAMES), self.energies.size
+        z_p, z_nu, z_st = z[:, :n_p], z[:, n_p:n_p + n_e], z[:, n_p + n_e:]
+        if self.factor.ndim == 3:
+            *resp, c, p0, p1 = self.params[:, None, :] + np.einsum('eij,nj->ine', self.factor, z_p)
+        else:
+            *resp, c, p0, p1 = (self.params + z_p @ self.factor.T).T[:, :, None]
+        nu = self.nubar + self.nubar_err * z_nu
+        g_mult = self.g_mult_raw + self.stat_err * z_st - c * nu + ng_pileup(self.energies, p0, p1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return gamma_unfolding(resp, g_mult)
+
+
+def saltelli_inputs(n, n_inputs, groups, seed=None):
+    """
+    Saltelli sample matrices from a scrambled Sobol sequence of standard normals.
+
+    Args:
+        n (int): Number of base samples (a power of 2 is best).
+        n_inputs (int): Number of inputs.
+        groups (list of list of int): Input columns of each factor.
+        seed (int or None): Scrambling seed. Defaults to None.
+
+    Returns:
+        (narray): Stacked [A, B, AB_1, ..., AB_k], shape ((k+2)*n, n_inputs),
+            AB_i being A with the columns of factor i taken from B.
+    """
+    from scipy.stats import qmc
+    from scipy.special import ndtri
+
+    u = qmc.Sobol(2 * n_inputs, scramble=True, seed=seed).random(n)
+    z = ndtri(np.clip(u, 1e-12, 1. - 1e-12))
+    a, b = z[:, :n_inputs], z[:, n_inputs:]
+    ab = np.repeat(a[None], len(groups), axis=0)
+    for i, cols in enumerate(groups):
+        ab[i][:, cols] = b[:, cols]
+    return np.concatenate([a, b, ab.reshape(-1, n_inputs)])
+
+
+def evaluate(model, z, n_workers=1, chunk_size=20000):
+    """
+    Evaluate a vectorized model on rows of inputs, in chunks, optionally over a
+    process pool (for expensive models; the model must be picklable).
+
+    Args:
+        model (callable): Function of an (n, n_inputs) array returning (n, ...) outputs.
+        z (narray): Inputs, shape (n, n_inputs).
+        n_workers (int or None): Number of processes (None for all CPUs). Defaults to 1 (in-process).
+        chunk_size (int): Number of rows per call. Defaults to 20000.
+
+    Returns:
+        (narray): Outputs, shape (n, ...).
+    """
+    chunks = [z[i:i + chunk_size] for i in range(0, len(z), chunk_size)]
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    if n_workers == 1 or len(chunks) == 1:
+        return np.concatenate([model(c) for c in chunks])
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        return np.concatenate(list(pool.map(model, chunks)))
+
+
+def sobol_indices(model, n_inputs, groups, n=8192, seed=None, n_workers=1, chunk_size=20000):
+    """
+    First-order (Saltelli 2010) and total (Jansen) Sobol indices of every
+    output of a model of independent standard normal inputs. Samples with a
+    non-finite output are dropped per output.
+
+    Args:
+        model (callable): Vectorized model, see evaluate.
+        n_inputs (int): Number of inputs.
+        groups (list of list of int): Input columns of each factor.
+        n (int): Number of base samples, (factors+2)*n evaluations. Defaults to 8192.
+        seed (int or None): Scrambling seed. Defaults to None.
+        n_workers (int or None): See evaluate. Defaults to 1.
+        chunk_size (int): See evaluate. Defaults to 20000.
+
+    Returns:
+        (narray): First-order indices, shape (factors, ...outputs).
+        (narray): Total indices, shape (factors, ...outputs).
+        (narray): Output variances, shape (...outputs).
+    """
+    k = len(groups)
+    z = saltelli_inputs(n, n_inputs, groups, seed=seed)
+    y = evaluate(model, z, n_workers=n_workers, chunk_size=chunk_size)
+    out_shape = y.shape[1:]
+    y = y.reshape(k + 2, n, -1)
+    y_a, y_b, y_ab = y[0], y[1], y[2:]
+
+    # samples finite in every matrix, per output
+
+    valid = np.isfinite(y).all(axis=0)
+    n_valid = valid.sum(axis=0)
+    y_a, y_b, y_ab = np.where(valid, y_a, 0.), np.where(valid, y_b, 0.), np.where(valid, y_ab, 0.)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (y_a + y_b).sum(axis=0) / (2 * n_valid)
+        var = (((y_a - mean)**2 + (y_b - mean)**2) * valid).sum(axis=0) / (2 * n_valid - 1)
+        first = (y_b * (y_ab - y_a)).sum(axis=1) / n_valid / var
+        total = 0.5 * ((y_a - y_ab)**2).sum(axis=1) / n_valid / var
+
+    return first.reshape((k,) + out_shape), total.reshape((k,) + out_shape), var.reshape(out_shape)
+
+
+def unfolding_sobol(energies, g_mult_raw, stat_err, n=8192, seed=None, n_workers=1, out_name=None, **kwargs):
+    """
+    Sobol indices of the unfolded gamma-rays multiplicity per energy bin,
+    for A, B, C, the pile-up line, JEFF nubar and the counting statistics.
+
+    Args:
+        energies (narray): Incident neutron energies [MeV].
+        g_mult_raw (narray): Raw measurements of gamma-rays multiplicity by SCONE.
+        stat_err (narray): 1-sigma statistical error of g_mult_raw.
+        n (int): Number of base samples. Defaults to 8192.
+        seed (int or None): Scrambling seed. Defaults to None.
+        n_workers (int or None): See evaluate. Defaults to 1.
+        out_name (str or None): Name of the output CSV file in outputs/. Defaults to None.
+        **kwargs: params, params_cov, nubar of UnfoldingModel.
+
+    Returns:
+        (pd.DataFrame): Energy, factor, first-order and total indices, output variance.
+    """
+    model = UnfoldingModel(energies, g_mult_raw, stat_err, **kwargs)
+    first, total, var = sobol_indices(model, model.n_inputs, model.groups, n=n, seed=seed, n_workers=n_workers)
+
+    table = pd.DataFrame({
+        "energy": np.tile(energies, len(model.names)),
+        "factor": np.repeat(model.names, len(energies)),
+        "first": first.ravel(),
+        "total": total.ravel(),
+        "var": np.tile(var, len(model.names)),
+    })
+
+    if out_name is not None:
+        os.makedirs(OUT_DIR, exist_ok=True)
+        table.to_csv(OUT_DIR/out_name, sep=" ", index=False, float_format="%.3g")
+
+    return table
+
+
+# run
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="GASCONE Sobol sensitivity analysis")
+    parser.add_argument("-n", "--samples", type=int, default=8192, help="number of base samples")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="number of processes")
+    parser.add_argument("--seed", type=int, default=None, help="scrambling seed")
+    parser.add_argument("-o", "--output", default="sobol_indices.csv", help="output CSV in outputs/")
+    args = parser.parse_args()
+
+    energies, g_mult_56us, stat_err_56us = scone_meas(filename="238U_meas_mg_56us.csv")
+    _, g_mult_5us6, stat_err_5us6 = scone_meas(filename="238U_meas_mg_5us6.csv")
+    g_mult_raw, merged_cov, _, _ = merge_windows(
+        [g_mult_56us, g_mult_5us6], [stat_err_56us, stat_err_5us6], method=MERGE, merg=3
+    )
+    stat_err = np.sqrt(np.diag(merged_cov))
+    table = unfolding_sobol(energies, g_mult_raw, stat_err, n=args.samples, seed=args.seed,
+                            n_workers=args.workers, out_name=args.output)
+    print(table.pivot(index="energy", columns="factor", values="total").round(3).to_string())
@@ -3,20 +3,18 @@
 # librairies
 
 import numpy as np
-from scipy.optimize import fsolve
-import pandas as pd
-from utils import *
-from plots import *
+from env import *
+from models import MODELS
+from profiling import profiled
 
 # functions 
 
-def gamma_unfolding(a, b, g_mult):
+def gamma_unfolding(resp, g_mult):
     """
     SCONE response function to pure fission gamma-rays.
 
     Args:
-        a (float): First gamma-rays multiplicity SCONE constant.
-        b (float): Second gamma-rays multiplicity SCONE constant.
+        resp (sequence): Constants of the response model RESPONSE_MODEL ((a, b) for "exp").
         g_mult (float): Raw measured gamma-rays multiplicity.
 
     Returns:
@@ -27,23 +25,21 @@ def gamma_unfolding(a, b, g_mult):
 
     g_mult = np.asarray(g_mult, dtype=float)
 
-    # SCONE response function 
+    # SCONE response function (inverse)
 
-    g_mult_corr = - b * np.log(1 - g_mult/a) # a*(1.0-np.exp(-g_mult/b))
+    g_mult_corr = MODELS[RESPONSE_MODEL].inverse(g_mult, *resp)
 
     return g_mult_corr
 
 
-def gamma_unfolding_uq(a, da, b, db, g_mult, g_mult_err=None):
+def gamma_unfolding_uq(resp, resp_err, g_mult, g_mult_err=None):
     """
     SCONE response function to pure fission gamma-rays 
     with uncertainty quantification.
 
     Args:
-        a (float): First gamma-rays multiplicity SCONE constant.
-        da (float): 1-sigma uncertainty of a. 
-        b (float): Second gamma-rays multiplicity SCONE constant.
-        db (float): 1-sigma uncertainty of b. 
+        resp (sequence): Constants of the response model RESPONSE_MODEL ((a, b) for "exp").
+        resp_err (sequence): 1-sigma uncertainties of the constants.
         g_mult (float): Raw measured gamma-rays multiplicity.
         g_mult_err (float): Statistical error of g_mult.
 
@@ -55,15 +51,13 @@ def gamma_unfolding_uq(a, da, b, db, g_mult, g_mult_err=None):
     # average response correction
 
     g_mult = np.asarray(g_mult, dtype=float)
-    g_mult_corr = gamma_unfolding(a, b, g_mult)
+    g_mult_corr = gamma_unfolding(resp, g_mult)
 
     # error propagation with partial derivatives
 
-    df_da = - b * (g_mult / (a**2 * (1.0 - g_mult / a)))
-    df_db = - np.log(1.0 - g_mult / a)
-    df_dg =   b / (a * (1.0 - g_mult / a))
+    df_dg, df_dp = MODELS[RESPONSE_MODEL].inverse_jac(g_mult, *resp)
 
-    var = (df_da * da)**2 + (df_db * db)**2
+    var = sum((df_dp[..., j] * err)**2 for j, err in enumerate(resp_err))
     if g_mult_err is not None:
         g_mult_err = np.asarray(g_mult_err, dtype=float)
         var += (df_dg * g_mult_err)**2
@@ -90,21 +84,156 @@ def neutron_contamination(c, dc, nubar, dnubar):
     return n_contam, sigma_n_contam
 
 
-def ng_pileup(e):
+def ng_pileup(e, p0=PILEUP[0], p1=PILEUP[1]):
     """
     Neutron-gamma pile-up on SCONE assemblies.
 
     Args:
         e (float or narray): Incident neutron energy [MeV].
+        p0 (float or narray): Pile-up at 1 MeV. Defaults to PILEUP[0].
+        p1 (float or narray): Pile-up slope [1/MeV]. Defaults to PILEUP[1].
 
     Returns:
         (float or narray): Fitted neutron-gamma pile-up multiplicity.
     """
-    pileup = 0.15 + 0.4*(e-1)/30
+    pileup = p0 + p1*(e-1)
     return pileup
 
 
-def g_mult_unfolding(energies, g_mult_raw, stat_err=None, out_name=None):
+def param_factor(params_cov):
+    """
+    Symmetric square root of parameters covariance matrices (may be singular).
+
+    Args:
+        params_cov (narray): Covariance, shape (PARAM_NAMES, PARAM_NAMES) or (energies, PARAM_NAMES, PARAM_NAMES).
+
+    Returns:
+        (narray): Symmetric factor L with L L' = params_cov, same shape (unique,
+            so that per-energy factors are consistent with each other).
+    """
+    w, v = np.linalg.eigh(params_cov)
+    return (v * np.sqrt(np.clip(w, 0., None))[..., None, :]) @ np.swapaxes(v, -1, -2)
+
+
+def param_samples(params, params_cov, n, rng):
+    """
+    Correlated samples of the unfolding parameters (fixed parameters allowed).
+    Per-energy parameters share the same normal draws (errors fully
+    correlated between energies).
+
+    Args:
+        params (narray): Parameters vector (PARAM_NAMES), or per energy (PARAM_NAMES, energies).
+        params_cov (narray): Parameters covariance matrix, or per energy (energies, PARAM_NAMES, PARAM_NAMES).
+        n (int): Number of samples.
+        rng (Generator): Random generator.
+
+    Returns:
+        (narray): Samples, shape (len(params), n) or (len(params), n, energies).
+    """
+    z = rng.standard_normal((n, len(params)))
+    factor = param_factor(params_cov)
+    if factor.ndim == 3:
+        return params[:, None, :] + np.einsum('eij,nj->ine', factor, z)
+    return (params + z @ factor.T).T
+
+
+def resolve_params(energies, params=None, params_cov=None):
+    """
+    Unfolding parameters and covariance, defaulting to ENV.params_at(energies)
+    (energy-dependent response parameters if ENERGY_RESPONSE).
+
+    Args:
+        energies (narray): Incident neutron energies [MeV].
+        params (narray or None): Parameters, (PARAM_NAMES,) or (PARAM_NAMES, energies).
+        params_cov (narray or None): Covariance, (PARAM_NAMES, PARAM_NAMES) or (energies, PARAM_NAMES, PARAM_NAMES).
+
+    Returns:
+        (narray): Parameters.
+        (narray): Covariance.
+    """
+    if params is None or params_cov is None:
+        default, default_cov = ENV.params_at(energies)
+        params = default if params is None else params
+        params_cov = default_cov if params_cov is None else params_cov
+    return np.asarray(params, dtype=float), np.asarray(params_cov, dtype=float)
+
+
+def g_mult_unfolding_errors(energies, g_mult_raw, stat_err=None, params=None, params_cov=None, nubar=None):
+    """
+    Error terms of unfolded gamma-rays multiplicities, from the Jacobians of the
+    neutron corrections and of the unfolding: the statistical errors, the
+    contributions of the correlated parameters (PARAM_NAMES) and the JEFF nubar
+    errors, so that the covariances between energy bins are their products.
+
+    Args:
+        energies (narray): Incident neutron energies [MeV].
+        g_mult_raw (narray): Raw measurements of gamma-rays nultiplicity by SCONE.
+        stat_err (narray): 1-sigma statistical error of g_mult_raw.
+        params (narray): Parameters (PARAM_NAMES), or per energy (PARAM_NAMES, energies). Defaults to ENV.params.
+        params_cov (narray): Parameters covariance, or per energy (energies, PARAM_NAMES, PARAM_NAMES). Defaults to ENV.params_cov.
+        nubar (tuple or None): (nubar, nubar_err) of the target per energy. Defaults to JEFF 238U.
+
+    Returns:
+        (narray): Statistical errors, shape (energies,).
+        (narray): Parameters terms, shape (energies, PARAM_NAMES).
+        (narray): Nubar errors, shape (energies,).
+    """
+
+    params, params_cov = resolve_params(energies, params, params_cov)
+    *resp, c, p0, p1 = params
+    nubar, nubar_err = (ENV.nubar_jeff, ENV.nubar_jeff_err) if nubar is None else nubar
+    g_mult = np.asarray(g_mult_raw, dtype=float) - c * nubar + ng_pileup(energies, p0, p1)
+
+    # partial derivatives of the unfolded multiplicity (energies, parameters)
+
+    df_dg, df_dp = MODELS[RESPONSE_MODEL].inverse_jac(g_mult, *resp)
+    jac = np.column_stack([
+        *np.moveaxis(df_dp, -1, 0),
+        - df_dg * nubar,
+        df_dg,
+        df_dg * (energies - 1)
+    ])
+
+    # statistical errors
+
+    stat_err = np.zeros_like(g_mult) if stat_err is None else np.asarray(stat_err, dtype=float)
+    stat_u = df_dg * stat_err
+
+    # systematic terms
+
+    syst_u = jac @ param_factor(params_cov).T if params_cov.ndim == 2 else np.einsum('ek,ekl->el', jac, param_factor(params_cov))
+    nubar_u = df_dg * c * nubar_err
+
+    return stat_u, syst_u, nubar_u
+
+
+def g_mult_unfolding_cov(energies, g_mult_raw, stat_err=None, params=None, params_cov=None, nubar=None):
+    """
+    Covariance matrices of unfolded gamma-rays multiplicities between energy bins
+    (see g_mult_unfolding_errors). Response parameters, C and the pile-up line
+    are shared by all bins (fully correlated systematic errors, also for
+    per-energy parameters), JEFF nubar errors are taken uncorrelated between bins.
+
+    Args:
+        energies (narray): Incident neutron energies [MeV].
+        g_mult_raw (narray): Raw measurements of gamma-rays nultiplicity by SCONE.
+        stat_err (narray): 1-sigma statistical error of g_mult_raw.
+        params (narray): Parameters (PARAM_NAMES), or per energy (PARAM_NAMES, energies). Defaults to ENV.params.
+        params_cov (narray): Parameters covariance, or per energy (energies, PARAM_NAMES, PARAM_NAMES). Defaults to ENV.params_cov.
+        nubar (tuple or None): (nubar, nubar_err) of the target per energy. Defaults to JEFF 238U.
+
+    Returns:
+        (narray): Statistical covariance matrix, shape (energies, energies).
+        (narray): Systematic covariance matrix, shape (energies, energies).
+    """
+    stat_u, syst_u, nubar_u = g_mult_unfolding_errors(energies, g_mult_raw, stat_err, params, params_cov, nubar)
+    stat_cov = np.diag(stat_u**2)
+    syst_cov = syst_u @ syst_u.T + np.diag(nubar_u**2)
+    return stat_cov, syst_cov
+
+
+@profiled()
+def g_mult_unfolding(energies, g_mult_raw, stat_err=None, out_name=None, params=None, params_cov=None, nubar=None):
     """
     Gamma-rays multiplicity unfolded from SCONE measurements.
 
@@ -113,39 +242,47 @@ def g_mult_unfolding(energies, g_mult_raw, stat_err=None, out_name=None):
         g_mult_raw (narray): Raw measurements of gamma-rays nultiplicity by SCONE.
         stat_err (narray): 1-sigma statistical error of g_mult_raw.
         out_name (str): Name of the output CSV file.
+        params (narray): Parameters (PARAM_NAMES), e.g. from global_fit, or per energy (PARAM_NAMES, energies). Defaults to ENV.params.
+        params_cov (narray): Parameters covariance, or per energy (energies, PARAM_NAMES, PARAM_NAMES). Defaults to ENV.params_cov.
+        nubar (tuple or None): (nubar, nubar_err) of the target per energy. Defaults to JEFF 238U.
 
     Returns:
         (narray): Unfolded gamma-rays multiplicities.
-        (narray): 1-sigma error on unfolded gamma-rays multiplicities.
+        (narray): 1-sigma error on unfolded gamma-rays multiplicities (square root of the
+            diagonal of the statistical and systematic covariances of the .cov.npz sidecar).
+        (narray): 1-sigma statistical error on unfolded gamma-rays multiplicities.
     """
 
     # neutron corrections
 
-    n_contam, n_contam_err = neutron_contamination(C, DC, nubar_jeff, nubar_jeff_err)
-    pileup = ng_pileup(energies)
-    g_mult = g_mult_raw - n_contam + pileup
+    params, params_cov = resolve_params(energies, params, params_cov)
+    *resp, c, p0, p1 = params
 
-    # uncertainty propagation
-
-    err_terms = [n_contam_err]
-
-    if stat_err is not None:
-        err_terms.append(np.asarray(stat_err, dtype=float))
+    nubar, nubar_err = (ENV.nubar_jeff, ENV.nubar_jeff_err) if nubar is None else nubar
+    n_contam, _ = neutron_contamination(c, 0., nubar, nubar_err)
+    pileup = ng_pileup(energies, p0, p1)
+    g_mult = g_mult_raw - n_contam + pileup
 
-    if len(err_terms) == 1:
-        g_mult_err = err_terms[0]
+    # unfolding
 
-    else:
-        g_mult_err = np.sqrt(np.sum([t**2 for t in err_terms], axis=0))
+    g_mult_corr = gamma_unfolding(resp, g_mult)
 
-    # unfolding
+    # uncertainty propagation (errors of the covariance sidecar, with the
+    # correlations between parameters)
 
-    g_mult_corr, g_mult_corr_err = gamma_unfolding_uq(A, DA, B, DB, g_mult, g_mult_err)
-    stat_err_corr = gamma_unfolding(A, B, stat_err)
+    stat_u, syst_u, nubar_u = g_mult_unfolding_errors(energies, g_mult_raw, stat_err, params, params_cov, (nubar, nubar_err))
+    g_mult_corr_err = np.sqrt(stat_u**2 + np.sum(syst_u**2, axis=1) + nubar_u**2)
+    stat_err_corr = np.abs(stat_u)
 
-    # saving csv
+    # saving csv and covariance sidecar (.cov.npz)
 
     if out_name is not None:
+        stat_cov = np.diag(stat_u**2)
+        syst_cov = syst_u @ syst_u.T + np.diag(nubar_u**2)
+        np.savez(
+            (OUT_DIR/out_name).with_suffix(".cov.npz"),
+            energy=energies, stat_cov=stat_cov, syst_cov=syst_cov
+        )
         data = np.column_stack([energies, g_mult_corr, g_mult_corr_err])
         np.savetxt(
             OUT_DIR/out_name,
@@ -156,3 +293,111 @@ def g_mult_unfolding(energies, g_mult_raw, stat_err=None, out_name=None):
         )
 
     return g_mult_corr, g_mult_corr_err, stat_err_corr
+
+
+@profiled()
+def g_mult_unfolding_mc(energies, g_mult_raw, stat_err=None, n_samples=100000,
+                        chunk_size=50000, percentiles=(2.5, 16., 50., 84., 97.5),
+                        n_hist=4000, seed=None, params=None, params_cov=None, nubar=None):
+    """
+    Gamma-rays multiplicity unfolded from SCONE measurements with Monte Carlo
+    uncertainty propagation. Correlated parameters (PARAM_NAMES) samples from the
+    parameters covariance, JEFF nubar and the statistical error are drawn as (chunk, energies)
+    arrays and pushed through the neutron corrections and the unfolding.
+    Moments are accumulated chunk by chunk and percentiles are read from
+    fixed-width histograms, so that memory does not depend on n_samples.
+
+    Args:
+        energies (narray): Incident neutron energies [MeV].
+        g_mult_raw (narray): Raw measurements of gamma-rays nultiplicity by SCONE.
+        stat_err (narray): 1-sigma statistical error of g_mult_raw.
+        n_samples (int): Number of Monte Carlo samples. Defaults to 100000.
+        chunk_size (int): Number of samples drawn at once. Defaults to 50000.
+        percentiles (tuple): Percentiles of the output distribution. Defaults to (2.5, 16, 50, 84, 97.5).
+        n_hist (int): Number of histogram bins per energy for percentiles. Defaults to 4000.
+        seed (int or None): Random generator seed. Defaults to None.
+        params (narray): Parameters (PARAM_NAMES), or per energy (PARAM_NAMES, energies). Defaults to ENV.params.
+        params_cov (narray): Parameters covariance, or per energy (energies, PARAM_NAMES, PARAM_NAMES). Defaults to ENV.params_cov.
+        nubar (tuple or None): (nubar, nubar_err) of the target per energy. Defaults to JEFF 238U.
+
+    Returns:
+        (narray): Average unfolded gamma-rays multiplicities.
+        (narray): Percentiles of unfolded multiplicities, shape (len(percentiles), energies).
+        (narray): Covariance matrix of unfolded multiplicities, shape (energies, energies).
+        (narray): Fraction of samples inside the physical domain, per energy.
+    """
+
+    rng = np.random.default_rng(seed)
+    g_mult_raw = np.asarray(g_mult_raw, dtype=float)
+    n_e = g_mult_raw.size
+    stat_err = np.zeros(n_e) if stat_err is None else np.asarray(stat_err, dtype=float)
+    params, params_cov = resolve_params(energies, params, params_cov)
+    nubar, nubar_err = (ENV.nubar_jeff, ENV.nubar_jeff_err) if nubar is None else nubar
+
+    def sample(n):
+        samples = param_samples(params, params_cov, n, rng)
+        *resp, c, p0, p1 = samples[:, :, None] if samples.ndim == 2 else samples
+        nu = nubar + nubar_err * rng.standard_normal((n, n_e))
+        g_mult = g_mult_raw + stat_err * rng.standard_normal((n, n_e)) - c * nu + ng_pileup(energies, p0, p1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return gamma_unfolding(resp, g_mult)
+
+    # pilot chunk: centering and histogram ranges
+
+    pilot = sample(min(chunk_size, n_samples))
+    center = np.nanmedian(pilot, axis=0)
+    lo, hi = np.nanpercentile(pilot, [0.01, 99.99], axis=0)
+    lo, hi = lo - (hi - lo), hi + (hi - lo)
+    width = (hi - lo) / n_hist
+
+    # accumulators
+
+    n_valid = np.zeros(n_e)
+    sum_x = np.zeros(n_e)
+    n_rows = 0
+    sum_row = np.zeros(n_e)
+    sum_outer = np.zeros((n_e, n_e))
+    hist = np.zeros(n_e * (n_hist + 2))
+    offsets = np.arange(n_e) * (n_hist + 2)
+
+    done, x = 0, pilot
+    while True:
+        finite = np.isfinite(x)
+        dx = np.where(finite, x - center, 0.)
+        n_valid += finite.sum(axis=0)
+        sum_x += dx.sum(axis=0)
+
+        rows = finite.all(axis=1)
+        n_rows += rows.sum()
+        sum_row += dx[rows].sum(axis=0)
+        sum_outer += dx[rows].T @ dx[rows]
+
+        idx = np.clip(np.floor((x - lo) / width), -1, n_hist) + 1
+        idx = (idx + offsets)[finite].astype(np.int64)
+        hist += np.bincount(idx, minlength=hist.size)
+
+        done += len(x)
+        if done >= n_samples:
+            break
+        x = sample(min(chunk_size, n_samples - done))
+
+    # moments
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g_mult_mean = center + sum_x / n_valid
+        mean_row = sum_row / n_rows
+        g_mult_cov = (sum_outer - n_rows * np.outer(mean_row, mean_row)) / (n_rows - 1)
+
+    # percentiles from cumulative histograms (under/overflow clamp to the range)
+
+    q = np.asarray(percentiles, dtype=float)[:, None, None] / 100.
+    cdf = np.cumsum(hist.reshape(n_e, n_hist + 2), axis=1)
+    cdf = cdf / np.maximum(cdf[:, -1:], 1.)
+    k = np.minimum((cdf[None] < q).sum(axis=2), n_hist + 1)
+    cdf_prev = np.where(k > 0, np.take_along_axis(np.broadcast_to(cdf, (len(q),) + cdf.shape), np.maximum(k - 1, 0)[..., None], axis=2)[..., 0], 0.)
+    cdf_cur = np.take_along_axis(np.broadcast_to(cdf, (len(q),) + cdf.shape), k[..., None], axis=2)[..., 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.where(cdf_cur > cdf_prev, (q[..., 0] - cdf_prev) / (cdf_cur - cdf_prev), 0.)
+    g_mult_pct = lo + width * np.clip(k - 1 + frac, 0, n_hist)
+
+    return g_mult_mean, g_mult_pct, g_mult_cov, n_valid / n_samples
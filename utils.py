@@ -4,9 +4,12 @@
 # librairies
 
 
+import os
+import hashlib
 import numpy as np
-import pandas as pd
 from pathlib import Path
+from moments import power_sums, count_moments
+from profiling import profiled
 
 
 # paths
@@ -15,6 +18,7 @@ from pathlib import Path
 PROJECT_DIR = Path('.') 
 OUT_DIR = PROJECT_DIR / 'outputs'
 FIG_DIR = PROJECT_DIR / 'figs'
+CACHE_DIR = PROJECT_DIR / '.cache'
 DATA_DIR = PROJECT_DIR / 'data'
 SCONE_DIR = DATA_DIR / 'scone'
 GEANT4_DIR = DATA_DIR / 'geant4'
@@ -22,6 +26,10 @@ EVAL_DIR = DATA_DIR / 'evaluations'
 LIT_DIR = DATA_DIR / 'literature'
 SIMU_DIR = DATA_DIR / 'simulations'
 
+# incident energy bins kept from SCONE measurements (1 to 30 MeV)
+
+ENERGY_BINS = slice(1, 31)
+
 # general functions 
 
 
@@ -57,6 +65,8 @@ def csv_data_reader(filepath):
         narray: Observable error.
     """
 
+    import pandas as pd # imported on first use only (slow import)
+
     df = pd.read_csv(filepath, sep=" ")
 
     # energy rows
@@ -85,61 +95,255 @@ def csv_data_reader(filepath):
     return energies, energies_err, mult, mult_err
 
 
-# SCONE measurements reader
+# multiplicity matrices (triplet files and binary format)
+
+
+MATRIX_DIR = CACHE_DIR / 'matrices'
 
 
-def scone_meas(filename = "238U_meas_mg_56us.csv"):
+def triplet_to_matrix(data, sparse=False):
     """
-    Read raw gamma-rays multiplicity distribution by SCONE.
+    Build a matrix from (x, y, z) triplets.
 
     Args:
-        filename (str): Name of the file from low-level analysis.
+        data (narray): Array of shape (n, 3) of (x, y, z) rows.
+        sparse (bool): Build a sparse (CSC) matrix of the non-zero triplets only. Defaults to False.
 
     Returns:
-        narray: Incident neutron energies.
-        narray: Raw gamma-rays multiplicity measurements.
+        narray: Sorted unique x values (columns).
+        narray: Sorted unique y values (rows).
+        narray or csc_array: Matrix of z values, shape (len(y), len(x)). Missing triplets are zeros.
     """
-    
-    # reading 
+    x_vals, ix = np.unique(data[:, 0], return_inverse=True)
+    y_vals, iy = np.unique(data[:, 1], return_inverse=True)
+    if sparse:
+        from scipy.sparse import csc_array
+        nz = data[:, 2] != 0
+        matrix = csc_array((data[nz, 2], (iy[nz], ix[nz])), shape=(y_vals.size, x_vals.size))
+        return x_vals, y_vals, matrix
+    matrix = np.zeros((y_vals.size, x_vals.size))
+    matrix[iy, ix] = data[:, 2]
+    return x_vals, y_vals, matrix
+
+
+def read_triplets(filepath):
+    """
+    Parse a whitespace separated (x, y, z) triplet file.
+
+    Args:
+        filepath (str or Path): Path to the text file.
+
+    Returns:
+        narray: Array of shape (n, 3).
+    """
+    import pandas as pd
+
+    return pd.read_csv(filepath, sep=r"\s+", header=None, comment="#", dtype=float).to_numpy()
+
+
+def write_triplets(filepath, x_vals, y_vals, matrix):
+    """
+    Write a dense matrix as a whitespace separated (x, y, z) triplet file.
+
+    Args:
+        filepath (str or Path): Path to the text file.
+        x_vals (narray): x values (columns).
+        y_vals (narray): y values (rows).
+        matrix (narray): Matrix of shape (len(y), len(x)).
+    """
+    X, Y = np.meshgrid(x_vals, y_vals, indexing='xy')
+    data = np.column_stack([X.T.ravel(), Y.T.ravel(), np.asarray(matrix).T.ravel()])
+    np.savetxt(filepath, data, fmt="%.10g", delimiter="\t")
+
+
+def matrix_paths(filepath, out_dir=None, sparse=False):
+    """
+    Paths of the binary version of a triplet file, named after the file and a
+    short hash of its resolved path (files of the same name in different
+    directories, or of the same stem, get different binary versions).
+
+    Args:
+        filepath (str or Path): Path to the text file.
+        out_dir (str or Path or None): Output directory. Defaults to MATRIX_DIR.
+        sparse (bool): Sparse version instead of the dense one. Defaults to False.
+
+    Returns:
+        Path: Dense matrix (.npy, memory-mappable) or sparse matrix (.npz).
+        Path: Axes and source metadata (.npz).
+    """
+    filepath = Path(filepath)
+    out_dir = MATRIX_DIR if out_dir is None else Path(out_dir)
+    digest = hashlib.sha256(str(filepath.resolve()).encode()).hexdigest()[:12]
+    stem = f"{filepath.stem}_{digest}"
+    if sparse:
+        return out_dir / f"{stem}.sparse.npz", out_dir / f"{stem}.sparse_axes.npz"
+    return out_dir / f"{stem}.matrix.npy", out_dir / f"{stem}.axes.npz"
+
+
+@profiled()
+def convert_triplets(filepath, out_dir=None, sparse=False):
+    """
+    Convert a triplet file into a binary matrix with its axes.
+
+    Args:
+        filepath (str or Path): Path to the text file.
+        out_dir (str or Path or None): Output directory. Defaults to MATRIX_DIR.
+        sparse (bool): Write a sparse (CSC) matrix instead of a dense one. Defaults to False.
+
+    Returns:
+        Path: Dense matrix (.npy) or sparse matrix (.npz).
+        Path: Axes and source metadata (.npz).
+    """
+    matrix_path, axes_path = matrix_paths(filepath, out_dir, sparse)
+    x_vals, y_vals, matrix = triplet_to_matrix(read_triplets(filepath), sparse)
+    stat = Path(filepath).stat()
+    matrix_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # atomic writes (other processes may be reading), the axes with the source
+    # stamp last so that a fresh stamp always comes with a complete matrix
+
+    tmp = _tmp_path(matrix_path)
+    if sparse:
+        from scipy.sparse import save_npz
+        save_npz(tmp, matrix)
+    else:
+        np.save(tmp, matrix)
+    os.replace(tmp, matrix_path)
+    tmp = _tmp_path(axes_path)
+    np.savez(tmp, x=x_vals, y=y_vals, source=np.array([stat.st_mtime_ns, stat.st_size]))
+    os.replace(tmp, axes_path)
+    return matrix_path, axes_path
+
+
+def _tmp_path(path):
+    """
+    Per-process temporary path next to a file, with the same suffix.
+    """
+    return path.with_name(f"{path.stem}.{os.getpid()}.tmp{path.suffix}")
 
-    data = np.loadtxt(SCONE_DIR/filename)
 
-    # components extraction 
+def load_matrix(matrix_path, axes_path, mmap=True):
+    """
+    Load a binary matrix written by convert_triplets.
+
+    Args:
+        matrix_path (str or Path): Dense matrix (.npy) or sparse matrix (.npz).
+        axes_path (str or Path): Axes and source metadata (.npz).
+        mmap (bool): Memory-map a dense matrix instead of reading it. Defaults to True.
+
+    Returns:
+        narray: x values (columns).
+        narray: y values (rows).
+        narray or csc_array: Matrix (read-only memory map if dense and mmap).
+    """
+    with np.load(axes_path) as axes:
+        x_vals, y_vals = axes["x"], axes["y"]
+    if Path(matrix_path).suffix == ".npz":
+        from scipy.sparse import load_npz, csc_array
+        return x_vals, y_vals, csc_array(load_npz(matrix_path))
+    matrix = np.load(matrix_path, mmap_mode="r" if mmap else None)
+    return x_vals, y_vals, matrix
 
-    X = data[:,0]
-    Y = data[:,1]
-    Z = data[:,2]
 
-    # pandas treatment
+@profiled()
+def read_matrix(filepath, mmap=True, sparse=False):
+    """
+    Read a triplet file as a matrix, through its binary version.
+    The binary version is (re)built when missing or older than the text file.
+
+    Args:
+        filepath (str or Path): Path to the text file.
+        mmap (bool): Memory-map a dense matrix instead of reading it. Defaults to True.
+        sparse (bool): Return a sparse (CSC) matrix, never densified. Defaults to False.
 
-    df = pd.DataFrame({'X':X,'Y':Y,'Z':Z})
-    Z_pivot = df.pivot(index='Y',columns='X',values='Z')
-    Z_normalized = Z_pivot.div(Z_pivot.sum(axis=0),axis=1)
-    X_grid, Y_grid = np.meshgrid(Z_normalized.columns,Z_normalized.index)
-    X_grid, Y_grid = np.clip(X_grid,1,30), np.clip(Y_grid,0,20)
-    Z_grid = Z_normalized.values
-    Z_grid = np.clip(Z_grid,0,0.2)
+    Returns:
+        narray: x values (columns).
+        narray: y values (rows).
+        narray or csc_array: Matrix of shape (len(y), len(x)).
+    """
+    matrix_path, axes_path = matrix_paths(filepath, sparse=sparse)
+    stat = Path(filepath).stat()
+    up_to_date = False
+    if matrix_path.exists() and axes_path.exists():
+        with np.load(axes_path) as axes:
+            up_to_date = axes["source"].tolist() == [stat.st_mtime_ns, stat.st_size]
+    if not up_to_date:
+        convert_triplets(filepath, sparse=sparse)
+    return load_matrix(matrix_path, axes_path, mmap=mmap)
 
-    # simple values
 
-    y_vals = Z_normalized.index.values[:, None]
-    p = Z_normalized.values 
+# SCONE measurements reader
 
-    # statistical moments
 
-    mean_Y = (y_vals*p).sum(axis=0)/Z_normalized.sum(axis=0)
-    mean_Y2 = ((y_vals**2) * p).sum(axis=0)/Z_normalized.sum(axis=0)
-    var_Y = mean_Y2 - mean_Y**2
-    var_Y = np.where(var_Y < 0, 0.0, var_Y) # protection against negative artefacts
+def scone_counts(filename = "238U_meas_mg_56us.csv", sparse=False):
+    """
+    Read raw counts of the gamma-rays multiplicity distribution by SCONE.
+
+    Args:
+        filename (str): Name of the file from low-level analysis.
+        sparse (bool): Return a sparse (CSC) count matrix. Defaults to False.
+
+    Returns:
+        narray: Incident neutron energies (all bins).
+        narray: Multiplicity axis.
+        narray or csc_array: Counts, shape (multiplicities, energies).
+    """
+    return read_matrix(SCONE_DIR/filename, sparse=sparse)
+
+
+@profiled()
+def scone_meas(filename = "238U_meas_mg_56us.csv", sparse=False):
+    """
+    Read raw gamma-rays multiplicity distribution by SCONE.
+
+    Args:
+        filename (str): Name of the file from low-level analysis.
+        sparse (bool): Work on a sparse count matrix. Defaults to False.
+
+    Returns:
+        narray: Incident neutron energies.
+        narray: Raw gamma-rays multiplicity measurements.
+    """
+    
+    # reading (multiplicity x energy grid)
+
+    energies_all, y_axis, counts = scone_counts(filename, sparse=sparse)
+
+    # statistical moments (one pass of power sums)
+
+    n, s1, s2 = power_sums(counts, y_axis, 2)
 
     with np.errstate(divide='ignore', invalid='ignore'):
-        sigma_mean = np.sqrt(var_Y / Z_pivot.sum(axis=0).values)
+        mean_Y = s1 / n
+        var_Y = s2 / n - mean_Y**2
+        var_Y = np.where(var_Y < 0, 0.0, var_Y) # protection against negative artefacts
+        sigma_mean = np.sqrt(var_Y / n)
         sigma_mean[~np.isfinite(sigma_mean)] = np.nan
 
     # final outputs
 
-    multg_raw = np.array(mean_Y)[1:31]
-    multg_err = np.array(sigma_mean)[1:31]
-    energies = np.unique(X)[1:31]
+    multg_raw = mean_Y[ENERGY_BINS]
+    multg_err = sigma_mean[ENERGY_BINS]
+    energies = energies_all[ENERGY_BINS]
 
     return energies, multg_raw, multg_err
+
+
+def scone_moments(filename = "238U_meas_mg_56us.csv", order=4, kinds=("raw", "central", "factorial", "cumulant", "shape"), sparse=False):
+    """
+    Moments of the raw gamma-rays multiplicity distribution by SCONE, with
+    their statistical covariances (see moments.count_moments).
+
+    Args:
+        filename (str): Name of the file from low-level analysis.
+        order (int): Highest moment order. Defaults to 4.
+        kinds (tuple of str): Moments to compute ("shape" is std, skewness, kurtosis).
+        sparse (bool): Work on a sparse count matrix. Defaults to False.
+
+    Returns:
+        narray: Incident neutron energies.
+        dict: For each kind, (moments, cov) of shapes (orders, energies) and (energies, orders, orders).
+    """
+    energies, y_axis, counts = scone_counts(filename, sparse=sparse)
+    results = count_moments(counts[:, ENERGY_BINS], y_axis, order=order, kinds=kinds)
+    return energies[ENERGY_BINS], results